@@ -0,0 +1,85 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from embedding_cache import normalize_query
+
+class AnswerCache:
+    """
+    Finished answers in a single SQLite file, keyed on everything that shapes the reply:
+    (model, normalize_query(query), retrieved vector ids in order, structure mode, index generation).
+    - rows older than `ttl` seconds are never served
+    - rows from another index generation are purged on the next lookup, so a refresh
+      that publishes a new index invalidates every answer built on the old one
+    - bounded by max_entries; oldest rows go first
+    """
+    def __init__(self, path: Path, ttl: float = 24 * 3600, max_entries: int = 5000):
+        self.path = Path(path)
+        self.ttl = float(ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._generation: Optional[str] = None
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, generation TEXT NOT NULL, reply TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_created ON answers(created)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, query: str, source_ids: Iterable[int], structure: str, generation: str) -> str:
+        h = hashlib.sha256()
+        ids = ",".join(str(int(i)) for i in source_ids)
+        h.update(f"{model}\0{normalize_query(query)}\0{ids}\0{structure}\0{generation}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _switch_generation(self, generation: str) -> None:
+        if generation != self._generation:
+            self._conn.execute("DELETE FROM answers WHERE generation != ?", (generation,))
+            self._conn.commit()
+            self._generation = generation
+
+    def get(self, key: str, generation: str) -> Optional[str]:
+        with self._lock:
+            self._switch_generation(generation)
+            row = self._conn.execute(
+                "SELECT reply, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, generation: str, reply: str) -> None:
+        with self._lock:
+            self._switch_generation(generation)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, generation, reply, created) VALUES (?, ?, ?, ?)",
+                (key, generation, reply, time.time()),
+            )
+            self._conn.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY created ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
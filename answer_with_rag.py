@@ -1,48 +1,73 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator, Optional
 from datetime import datetime, timedelta
+from pathlib import Path
+import asyncio
 import re
 import os
 
 from semantic_search import (
-    search,
-    search_meetings,
-    search_in_date_window,
+    CandidatePool,
+    candidate_pool,
+    candidate_pool_async,
+    chunk_texts,
+    rerank,
+    rerank_for_recency,
+    last_retrieval_mode,
+    MODE_LEXICAL_OFFLINE,
+    current_generation,
 )
-
-# OpenAI client setup (new SDK preferred, fallback legacy)
-try:
-    from openai import OpenAI
-    _client = OpenAI()
-    _use_client = True
-except Exception:
-    _client = None
-    _use_client = False
-    import openai  # type: ignore
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+import llm_client
+from answer_cache import AnswerCache
+from context_packer import PACK_GREEDY, Snippet, Span, pack
 
 # Use GPT-5 for chat/answers
 COMPLETIONS_MODEL = "gpt-5"
-MAX_CONTEXT_CHARS = 8000
+
+# Prompt budget for retrieved sources, in tokens of the answering model
+CONTEXT_TOKEN_BUDGETS = {"gpt-5": 2500}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0")) or CONTEXT_TOKEN_BUDGETS.get(COMPLETIONS_MODEL, 2500)
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", PACK_GREEDY)  # "greedy" | "knapsack"
+
+# Finished answers, reused for the same question over the same sources and index generation
+ANSWER_CACHE_PATH = Path("embeddings/answer_cache.sqlite")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))  # seconds; 0 disables
 
 # ─────────────────────────────────────────────────────────────
 # Context Builder
 # ─────────────────────────────────────────────────────────────
+def _render_span(span: Span) -> str:
+    cid = str(span.first_chunk) if span.first_chunk == span.last_chunk else f"{span.first_chunk}-{span.last_chunk}"
+    return f"[SOURCE: {span.filename} | CHUNK: {cid}]\n{span.text}\n"
+
 def build_context(topk: List[Tuple[int, float, Dict]]) -> str:
     """
     Create a compact context: [SOURCE: filename | CHUNK: id]
-    Then snippet text, respecting MAX_CONTEXT_CHARS.
+    Then the full chunk text (fetched from the chunk store for these hits only), packed
+    into CONTEXT_TOKEN_BUDGET tokens (see context_packer.pack); consecutive chunks of one
+    file are sent once as [SOURCE: filename | CHUNK: 2-3].
     """
-    parts, total = [], 0
-    for _, _, meta in topk:
-        fname = meta.get("filename", "unknown.txt")
-        cid = meta.get("chunk_id", 0)
-        text = meta.get("text_preview", "")
-        snippet = f"[SOURCE: {fname} | CHUNK: {cid}]\n{text}\n"
-        if total + len(snippet) > MAX_CONTEXT_CHARS:
-            break
-        parts.append(snippet)
-        total += len(snippet)
-    return "\n".join(parts)
+    snippets = [
+        Snippet(meta.get("filename", "unknown.txt"), int(meta.get("chunk_id", 0)), text, meta.get("char_start"), meta.get("char_end"))
+        for (_, _, meta), text in zip(topk, chunk_texts(topk))
+    ]
+    spans = pack(
+        snippets,
+        _render_span,
+        budget=CONTEXT_TOKEN_BUDGET,
+        model=COMPLETIONS_MODEL,
+        mode=CONTEXT_PACKING,
+    )
+    return "\n".join(_render_span(s) for s in spans)
+
+def _sources_only_reply(topk: List[Tuple[int, float, Dict]], err: Exception) -> str:
+    """What we can still offer when the model is unreachable: the matching sources themselves."""
+    lines = [f"The assistant model is unavailable right now ({err}). Closest matching sources:"]
+    for (_, _, meta), text in zip(topk, chunk_texts(topk)):
+        preview = text.strip().replace("\n", " ")[:200]
+        lines.append(f"- [{meta.get('filename', 'unknown.txt')}#{meta.get('chunk_id', 0)}] {preview}")
+    return "\n".join(lines)
+
+OFFLINE_NOTE = "\n\n_Retrieval mode: offline keyword search (embeddings API unreachable)._"
 
 # ─────────────────────────────────────────────────────────────
 # Date-window resolution from user query (extended)
@@ -161,12 +186,24 @@ def is_generative(q: str) -> bool:
 # ─────────────────────────────────────────────────────────────
 # Chat Completion (no temperature for GPT-5)
 # ─────────────────────────────────────────────────────────────
-def ask_gpt(
+def _history_messages(chat_history: List[Dict]) -> List[Dict]:
+    # Include up to last 4 chat history turns
+    turns: List[Dict] = []
+    for msg in chat_history[-4:]:
+        content = msg.get("content", "")
+        timestamp = msg.get("timestamp", "")
+        role = msg.get("role", "user")
+        formatted = f"[{timestamp}] {content}" if timestamp else content
+        turns.append({"role": role, "content": formatted})
+    return turns
+
+def _build_messages(
     query: str,
     context: str = "",
     chat_history: List[Dict] = [],
     structure: str = "none",
-) -> str:
+    history: Optional[List[Dict]] = None,
+) -> List[Dict]:
     system = (
         "You are a precise Virtual CEO assistant. "
         "When sources are provided, use them and cite [filename#chunk] like [2025-09-02_Meeting-Summary.txt#2]. "
@@ -182,37 +219,116 @@ def ask_gpt(
         )
 
     messages: List[Dict] = [{"role": "system", "content": system}]
-
-    # Include up to last 4 chat history turns
-    for msg in chat_history[-4:]:
-        content = msg.get("content", "")
-        timestamp = msg.get("timestamp", "")
-        role = msg.get("role", "user")
-        formatted = f"[{timestamp}] {content}" if timestamp else content
-        messages.append({"role": role, "content": formatted})
+    messages.extend(history if history is not None else _history_messages(chat_history))
 
     if context:
         messages.append({"role": "user", "content": f"Query:\n{query}\n\nSources:\n{context}"})
     else:
         messages.append({"role": "user", "content": query})
 
+    return messages[-6:]
+
+def ask_gpt(
+    query: str,
+    context: str = "",
+    chat_history: List[Dict] = [],
+    structure: str = "none",
+) -> str:
+    messages = _build_messages(query, context, chat_history, structure)
+
     # IMPORTANT: no temperature passed for GPT-5
-    if _use_client:
-        resp = _client.chat.completions.create(  # type: ignore
-            model=COMPLETIONS_MODEL,
-            messages=messages[-6:],
-        )
-        return resp.choices[0].message.content
-    else:
-        resp = openai.ChatCompletion.create(  # type: ignore
-            model=COMPLETIONS_MODEL,
-            messages=messages[-6:],
-        )
-        return resp.choices[0].message["content"]
+    return llm_client.chat(COMPLETIONS_MODEL, messages)
+
+def ask_gpt_stream(
+    query: str,
+    context: str = "",
+    chat_history: List[Dict] = [],
+    structure: str = "none",
+) -> Iterator[str]:
+    """Same prompt as ask_gpt, but yields the completion text piece by piece as it arrives."""
+    messages = _build_messages(query, context, chat_history, structure)
+    yield from llm_client.chat_stream(COMPLETIONS_MODEL, messages)
+
+# ─────────────────────────────────────────────────────────────
+# Retrieval planner: one embedding + at most two ANN searches per answer
+# ─────────────────────────────────────────────────────────────
+def _has_meeting_hits(hs) -> bool:
+    for _, _, meta in hs or []:
+        if (meta.get("folder", "") or "").lower() == "meetings":
+            return True
+    return False
+
+def plan_retrieval(query: str, k: int = 5, restrict_to_meetings: bool = False) -> List[Tuple[int, float, Dict]]:
+    """
+    Pull a single candidate pool (semantic_search.candidate_pool) and evaluate the
+    strategies over it in order, taking the first that yields hits:
+      1) date window found in the query → in-window chunks, recency-ranked
+      2) restrict_to_meetings → meetings-first rerank of the Meetings-folder chunks nearest the query
+      3) general nearest neighbours (fallback A: no meeting hits; fallback B: empty window)
+    """
+    win = resolve_date_window_from_query(query)
+    start, end = win if win else (None, None)
+    pool = candidate_pool(query, start=start, end=end, meetings=restrict_to_meetings and not win)
+    return _plan(pool, query, k, restrict_to_meetings, bool(win))
+
+def _plan(pool: CandidatePool, query: str, k: int, restrict_to_meetings: bool, windowed: bool) -> List[Tuple[int, float, Dict]]:
+    general = pool.general[:k]  # only the final top-k reach build_context (full text is read per hit)
+
+    if windowed:
+        hits = rerank_for_recency(pool.windowed or [], query=query)[:k]
+        # Fallback B: date window yielded nothing → general pool (no window)
+        if not hits:
+            hits = general
+        # Fallback A (in date path): forced meetings but no meeting hits → general pool
+        if restrict_to_meetings and not _has_meeting_hits(hits) and general:
+            hits = general
+        return hits
+
+    if restrict_to_meetings:
+        meetings = pool.meetings if pool.meetings is not None else pool.general[:max(k, 100)]
+        hits = rerank(meetings, query=query, prefer_meetings=True, prefer_recent=True)[:k]
+        # Fallback A (no date path): meetings requested but not actually meeting hits
+        if not _has_meeting_hits(hits) and general:
+            hits = general
+        return hits
+
+    return general
 
 # ─────────────────────────────────────────────────────────────
 # Public API (with strong fallbacks A & B)
 # ─────────────────────────────────────────────────────────────
+def _prepare(
+    query: str,
+    k: int,
+    restrict_to_meetings: bool,
+    use_rag: bool,
+) -> Tuple[List[Tuple[int, float, Dict]], str, str, bool]:
+    """Retrieval half of answer(): (hits, context, structure, offline)."""
+    # Generative bypass or explicit GPT-only mode
+    if not use_rag or is_generative(query):
+        return [], "", "none", False
+
+    hits = plan_retrieval(query, k=k, restrict_to_meetings=restrict_to_meetings)
+    offline = last_retrieval_mode() == MODE_LEXICAL_OFFLINE
+    return _with_context(query, hits, restrict_to_meetings, offline)
+
+def _with_context(
+    query: str,
+    hits: List[Tuple[int, float, Dict]],
+    restrict_to_meetings: bool,
+    offline: bool,
+) -> Tuple[List[Tuple[int, float, Dict]], str, str, bool]:
+    # If nothing usable, answer without sources
+    if not hits:
+        return [], "", "none", offline
+
+    # Build context and choose structure
+    ctx = build_context(hits)
+    is_meeting_ctx = any((meta.get("folder", "").lower() == "meetings") for _, _, meta in hits)
+    wants_summary = bool(re.search(r"\b(summary|summarize|decisions?|action items?)\b", query, re.I))
+    structure = "meeting_summary" if (is_meeting_ctx and (restrict_to_meetings or wants_summary)) else "none"
+    return hits, ctx, structure, offline
+
 def answer(
     query: str,
     k: int = 5,
@@ -222,60 +338,182 @@ def answer(
 ) -> str:
     """
     - Detects relative/specific dates and restricts retrieval to that window when found.
+    - Retrieval costs one query embedding and one ANN search, plus one restricted to the
+      date window or the Meetings folder when either is larger than PLAN_EXACT_LIMIT chunks
+      (see plan_retrieval).
     - Skips retrieval entirely for generative asks or when use_rag=False.
     - Structures meeting digests when appropriate (Agenda / Decisions / Action Items).
     - Fallbacks:
         A) If restrict_to_meetings=True but we got no meeting hits, fall back to general search.
         B) If a date window is requested but returns no hits, fall back to general search (no window).
+    - If the embeddings API is down, retrieval degrades to offline keyword search and the
+      reply says so; if the chat model is down too, the matching sources are returned.
+    - Sourced answers are cached per (query, source ids, structure, index generation) for
+      ANSWER_CACHE_TTL seconds; publishing a new index invalidates them.
     """
-    # Generative bypass or explicit GPT-only mode
-    if not use_rag or is_generative(query):
-        return ask_gpt(query, context="", chat_history=chat_history, structure="none")
-
-    def _has_meeting_hits(hs):
-        for _, _, meta in hs or []:
-            if (meta.get("folder", "") or "").lower() == "meetings":
-                return True
-        return False
-
-    hits = []
-
-    # 1) Date-scoped search if query contains a window
-    win = resolve_date_window_from_query(query)
-    if win:
-        start, end = win
-        hits = search_in_date_window(query, start, end, k=k)
-
-        # Fallback B: date window yielded nothing → try general search (no window)
+    hits, ctx, structure, offline = _prepare(query, k, restrict_to_meetings, use_rag)
+    note = OFFLINE_NOTE if offline else ""
+
+    if not offline:
+        slot = _cached_slot(query, hits, structure, offline)
+        reply = _cache_get(slot)
+        if reply is None:
+            reply = ask_gpt(query, context=ctx, chat_history=chat_history, structure=structure)
+            _cache_put(slot, reply)
+        return reply
+    try:
+        return ask_gpt(query, context=ctx, chat_history=chat_history, structure=structure) + note
+    except Exception as e:
         if not hits:
-            hits = search(query, k=k)
-
-        # Fallback A (in date path): forced meetings but no meeting hits → try general search
-        if restrict_to_meetings and not _has_meeting_hits(hits):
-            alt = search(query, k=k)
-            if alt:
-                hits = alt
-    else:
-        # 2) No date window → prefer meetings only if user asked
-        hits = search_meetings(query, k=k) if restrict_to_meetings else search(query, k=k)
+            raise
+        return _sources_only_reply(hits[:k], e) + note
 
-        # Fallback A (no date path): meetings requested but not actually meeting hits
-        if restrict_to_meetings and not _has_meeting_hits(hits):
-            alt = search(query, k=k)
-            if alt:
-                hits = alt
+def answer_stream(
+    query: str,
+    k: int = 5,
+    chat_history: List[Dict] = [],
+    restrict_to_meetings: bool = False,
+    use_rag: bool = True,
+) -> Iterator[str]:
+    """
+    Streaming answer(): identical retrieval and prompt, but yields the reply as the
+    model produces it, so the caller can render the first words while the rest is
+    still being generated. Joining the pieces gives the same text answer() returns.
+    A cached answer is yielded in one piece; a fresh one is cached once the stream completes.
+    """
+    hits, ctx, structure, offline = _prepare(query, k, restrict_to_meetings, use_rag)
+    note = OFFLINE_NOTE if offline else ""
+
+    slot = _cached_slot(query, hits, structure, offline)
+    cached = _cache_get(slot)
+    if cached is not None:
+        yield cached
+        return
+
+    started = False
+    pieces: List[str] = []
+    try:
+        for piece in ask_gpt_stream(query, context=ctx, chat_history=chat_history, structure=structure):
+            started = True
+            pieces.append(piece)
+            yield piece
+        _cache_put(slot, "".join(pieces))
+    except Exception as e:
+        # Same degraded path as answer(), as long as nothing has been shown yet
+        if not offline or started or not hits:
+            raise
+        yield _sources_only_reply(hits[:k], e)
+    if note:
+        yield note
 
-    # If nothing usable, answer without sources
-    if not hits:
-        return ask_gpt(query, context="", chat_history=chat_history, structure="none")
+# ─────────────────────────────────────────────────────────────
+# Async pipeline: no thread held across network waits
+# ─────────────────────────────────────────────────────────────
+async def _prepare_async(
+    query: str,
+    k: int,
+    restrict_to_meetings: bool,
+    use_rag: bool,
+) -> Tuple[List[Tuple[int, float, Dict]], str, str, bool]:
+    """_prepare() with the query embedding awaited (and BM25 run alongside it)."""
+    if not use_rag or is_generative(query):
+        return [], "", "none", False
+    win = resolve_date_window_from_query(query)
+    start, end = win if win else (None, None)
+    pool = await candidate_pool_async(query, start=start, end=end, meetings=restrict_to_meetings and not win)
+    hits = _plan(pool, query, k, restrict_to_meetings, bool(win))
+    # token counting for the packer is CPU work; keep it off the event loop
+    return await asyncio.to_thread(_with_context, query, hits, restrict_to_meetings, pool.mode == MODE_LEXICAL_OFFLINE)
 
-    # Build context and choose structure
-    ctx = build_context(hits)
-    is_meeting_ctx = any((meta.get("folder", "").lower() == "meetings") for _, _, meta in hits)
-    wants_summary = bool(re.search(r"\b(summary|summarize|decisions?|action items?)\b", query, re.I))
-    structure = "meeting_summary" if (is_meeting_ctx and (restrict_to_meetings or wants_summary)) else "none"
+async def _answer_async(
+    query: str,
+    k: int,
+    chat_history: List[Dict],
+    restrict_to_meetings: bool,
+    use_rag: bool,
+) -> str:
+    history = _history_messages(chat_history)
+    hits, ctx, structure, offline = await _prepare_async(query, k, restrict_to_meetings, use_rag)
+    note = OFFLINE_NOTE if offline else ""
+
+    slot = _cached_slot(query, hits, structure, offline)
+    cached = _cache_get(slot)
+    if cached is not None:
+        return cached
+
+    messages = _build_messages(query, context=ctx, structure=structure, history=history)
+    try:
+        reply = await llm_client.achat(COMPLETIONS_MODEL, messages)
+    except Exception as e:
+        if not offline or not hits:
+            raise
+        return _sources_only_reply(hits[:k], e) + note
+    _cache_put(slot, reply)
+    return reply + note
+
+async def answer_async(
+    query: str,
+    k: int = 5,
+    chat_history: List[Dict] = [],
+    restrict_to_meetings: bool = False,
+    use_rag: bool = True,
+    deadline: Optional[float] = None,
+) -> str:
+    """
+    answer() for event loops: same retrieval, prompt, cache and fallbacks, but the
+    query embedding and the BM25 lookup run concurrently and no thread is held
+    while waiting on the API. `deadline` (seconds) bounds the whole
+    answer and raises asyncio.TimeoutError; cancelling the awaiting task cancels the
+    in-flight requests.
+    """
+    coro = _answer_async(query, k, chat_history, restrict_to_meetings, use_rag)
+    if deadline is None:
+        return await coro
+    return await asyncio.wait_for(coro, deadline)
 
-    return ask_gpt(query, context=ctx, chat_history=chat_history, structure=structure)
+# ─────────────────────────────────────────────────────────────
+# Answer cache (see answer_cache.AnswerCache)
+# ─────────────────────────────────────────────────────────────
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_failed = False
+
+def _answers() -> Optional[AnswerCache]:
+    global _answer_cache, _answer_cache_failed
+    if _answer_cache is None and not _answer_cache_failed and ANSWER_CACHE_TTL > 0:
+        try:
+            _answer_cache = AnswerCache(ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL)
+        except Exception as e:
+            print(f"⚠️ Answer cache unavailable ({e}); answering uncached.")
+            _answer_cache_failed = True
+    return _answer_cache
+
+def _cached_slot(query: str, hits, structure: str, offline: bool) -> Optional[Tuple[AnswerCache, str, str]]:
+    """(cache, key, generation) when this answer may be cached: sourced, and not a degraded-mode reply."""
+    cache = _answers()
+    if cache is None or not hits or offline:
+        return None
+    generation = current_generation()
+    key = AnswerCache.key(COMPLETIONS_MODEL, query, [vid for vid, _, _ in hits], structure, generation)
+    return cache, key, generation
+
+def _cache_get(slot) -> Optional[str]:
+    if slot is None:
+        return None
+    cache, key, generation = slot
+    try:
+        return cache.get(key, generation)
+    except Exception as e:
+        print(f"⚠️ Answer cache lookup failed: {e}")
+        return None
+
+def _cache_put(slot, reply: str) -> None:
+    if slot is None or not reply:
+        return
+    cache, key, generation = slot
+    try:
+        cache.put(key, generation, reply)
+    except Exception as e:
+        print(f"⚠️ Could not cache answer: {e}")
 
 # Optional CLI test
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import json
 import re
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -8,7 +9,7 @@ import streamlit as st
 
 import file_parser
 import embed_and_store
-from answer_with_rag import answer
+from answer_with_rag import answer_stream
 
 # ─────────────────────────────────────────────────────────────
 # App Config
@@ -221,27 +222,40 @@ elif mode == "💬 New Chat":
         history.append({"role": "user", "content": user_msg, "timestamp": now})
 
         with st.chat_message("assistant"):
-            with st.spinner("🤔 Thinking…"):
-                try:
-                    reply = answer(
-                        user_msg,
-                        k=7,
-                        chat_history=history,
-                        restrict_to_meetings=st.session_state["limit_meetings"],
-                        use_rag=st.session_state["use_rag"],
-                    )
-                except TypeError:
-                    # Backward compatible with older answer() signature
-                    reply = answer(
-                        user_msg,
-                        k=7,
-                        chat_history=history,
-                        restrict_to_meetings=st.session_state["limit_meetings"],
-                    )
-                except Exception as e:
-                    reply = f"Error: {e}"
+            header = st.empty()
+            body = st.empty()
+            header.markdown("🤔 Thinking…")
+            t0 = time.perf_counter()
+            ttft = None
+            reply = ""
+            try:
+                for piece in answer_stream(
+                    user_msg,
+                    k=7,
+                    chat_history=history,
+                    restrict_to_meetings=st.session_state["limit_meetings"],
+                    use_rag=st.session_state["use_rag"],
+                ):
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                        header.markdown(f"🧾 [{datetime.now().strftime('%b-%d-%Y %I:%M%p')}]")
+                    reply += piece
+                    body.markdown(reply + "▌")
+            except Exception as e:
+                reply += f"\n\nError: {e}" if reply else f"Error: {e}"
             ts = datetime.now().strftime("%b-%d-%Y %I:%M%p")
-            st.markdown(f"🧾 [{ts}]  \n{reply}")
-
-        history.append({"role": "assistant", "content": reply, "timestamp": ts})
+            total = time.perf_counter() - t0
+            header.markdown(f"🧾 [{ts}]")
+            body.markdown(reply)
+            if ttft is not None:
+                st.caption(f"⚡ First token {ttft:.2f}s · complete {total:.2f}s")
+
+        # Persist only once the stream has finished so history never holds a partial reply
+        history.append({
+            "role": "assistant",
+            "content": reply,
+            "timestamp": ts,
+            "ttft_s": round(ttft, 3) if ttft is not None else None,
+            "latency_s": round(total, 3),
+        })
         save_history(history)
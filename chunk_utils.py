@@ -1,24 +1,313 @@
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 import re
+import sys
 
-def simple_chunks(text: str, max_chars: int = 3500, overlap: int = 300) -> List[Dict]:
+from token_utils import DEFAULT_MODEL, count_tokens
+
+_PARA_SEP = re.compile(r"(\n{2,})")
+_LINE_SEP = re.compile(r"\n")
+_SENTENCE_SEP = re.compile(r"(?<=[.!?;])\s+")
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """
+    (offset, paragraph) pairs from an iterable of newline-terminated lines, e.g. an open
+    text file. Paragraphs are separated by blank lines and stripped, exactly like
+    re.split(r"\\n{2,}", text); `offset` is where the stripped paragraph starts in the source.
+    Only one paragraph is held at a time.
+    """
+    buf: List[str] = []
+    start = pos = 0
+    for line in lines:
+        if line == "\n":
+            if buf:
+                yield from _stripped(start, "".join(buf))
+                buf = []
+            pos += 1
+            continue
+        if not buf:
+            start = pos
+        buf.append(line)
+        pos += len(line)
+    if buf:
+        yield from _stripped(start, "".join(buf))
+
+def _stripped(start: int, raw: str) -> Iterator[Tuple[int, str]]:
+    p = raw.strip()
+    if p:
+        yield start + (len(raw) - len(raw.lstrip())), p
+
+def _text_paragraphs(text: str) -> Iterator[Tuple[int, str]]:
+    """iter_paragraphs() for a string already in memory."""
+    pos = 0
+    parts = _PARA_SEP.split(text)  # capturing split: paragraph, separator, paragraph, ...
+    for i, raw in enumerate(parts):
+        if not i % 2:
+            p = raw.strip()
+            if p:
+                yield pos + len(raw) - len(raw.lstrip()), p
+        pos += len(raw)
+
+# ─────────────────────────────────────────────────────────────
+# Oversize paragraphs: line → sentence → hard boundaries
+# ─────────────────────────────────────────────────────────────
+def _units(text: str, sep: "re.Pattern") -> List[Tuple[int, int]]:
+    """(start, end) of the non-blank pieces of text between separator matches."""
+    out, start = [], 0
+    for m in sep.finditer(text):
+        if text[start:m.start()].strip():
+            out.append((start, m.start()))
+        start = m.end()
+    if text[start:].strip():
+        out.append((start, len(text)))
+    return out
+
+def _hard_pieces(text: str, max_chars: int, max_tokens: Optional[int], model: str) -> Iterator[Tuple[int, int]]:
+    """Last resort: consecutive slices under both limits, cut at whitespace when there is some."""
+    i = 0
+    while i < len(text):
+        n = min(max_chars, len(text) - i)
+        if max_tokens is not None:
+            while n > 1 and count_tokens(text[i:i + n], model) > max_tokens:
+                n = max(1, n * max_tokens // count_tokens(text[i:i + n], model) - 1)
+        if i + n < len(text):
+            ws = max(text.rfind(" ", i, i + n), text.rfind("\n", i, i + n))
+            if ws > i + n // 2:
+                n = ws - i
+        yield i, i + n
+        i += n
+
+def _split_oversize(
+    src: int,
+    p: str,
+    max_chars: int,
+    max_tokens: Optional[int],
+    model: str,
+    level: int = 0,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Split one paragraph into stripped (offset, piece) pairs that each fit max_chars and
+    max_tokens: at line breaks first, then sentence ends, then hard boundaries. Neighbouring
+    units are packed back together while they fit, so pieces stay as large as allowed.
+    """
+    def tokens(t: str) -> int:
+        return count_tokens(t, model) if max_tokens is not None else 0
+
+    def fits(n_chars: int, n_tokens: int) -> bool:
+        return n_chars <= max_chars and (max_tokens is None or n_tokens <= max_tokens)
+
+    if fits(len(p), tokens(p)):
+        yield src, p
+        return
+    if level >= 2:
+        spans = list(_hard_pieces(p, max_chars, max_tokens, model))
+    else:
+        spans = _units(p, _LINE_SEP if level == 0 else _SENTENCE_SEP)
+        if len(spans) <= 1:
+            yield from _split_oversize(src, p, max_chars, max_tokens, model, level + 1)
+            return
+
+    run_start = run_end = None
+    run_tokens = 0
+    def emit(a: int, b: int) -> Iterator[Tuple[int, str]]:
+        raw = p[a:b]
+        piece = raw.strip()
+        if piece:
+            yield src + a + len(raw) - len(raw.lstrip()), piece
+
+    for a, b in spans:
+        t = tokens(p[a:b])
+        if not fits(b - a, t):
+            if run_start is not None:
+                yield from emit(run_start, run_end)
+                run_start = None
+            off = a + len(p[a:b]) - len(p[a:b].lstrip())
+            yield from _split_oversize(src + off, p[a:b].strip(), max_chars, max_tokens, model, level + 1)
+            continue
+        # summed token counts (+1 per separator) are a close upper bound on the joined count
+        if run_start is not None and fits(b - run_start, run_tokens + t + 1):
+            run_end, run_tokens = b, run_tokens + t + 1
+            continue
+        if run_start is not None:
+            yield from emit(run_start, run_end)
+        run_start, run_end, run_tokens = a, b, t
+    if run_start is not None:
+        yield from emit(run_start, run_end)
+
+UNIT_CHARS = "chars"
+UNIT_TOKENS = "tokens"
+
+def stream_chunks(
+    lines: Iterable[str],
+    max_chars: int = 3500,
+    overlap: int = 300,
+    max_tokens: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+) -> Iterator[Dict]:
+    """
+    Streaming simple_chunks(): yields {"chunk_id", "text", "start", "end", "tokens"} from an
+    iterable of lines (e.g. an open parsed file) in one pass, holding at most one chunk plus
+    one paragraph in memory.
+    - text is identical to simple_chunks() over the same source
+    - start/end are character offsets into the source: `start` is where the chunk's first
+      character (possibly inside the carried-over overlap) comes from, `end` is just past
+      its last paragraph
+    - tokens is the chunk's token count for `model`
+    """
+    return _chunk_paragraphs(iter_paragraphs(lines), max_chars, overlap, max_tokens, model)
+
+def stream_token_chunks(
+    lines: Iterable[str],
+    target_tokens: int = 800,
+    overlap_tokens: int = 80,
+    max_tokens: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+) -> Iterator[Dict]:
+    """stream_chunks() sized in tokens of `model` instead of characters (see token_chunks)."""
+    return _chunk_paragraphs(iter_paragraphs(lines), target_tokens, overlap_tokens, max_tokens, model, unit=UNIT_TOKENS)
+
+Spans = List[Tuple[int, int, int]]  # (pos_in_text, src_offset, length) runs copied verbatim from the source
+
+def _token_suffix_cut(text: str, n_tokens: int, model: str) -> int:
+    """Start of the longest suffix of text with at most n_tokens tokens, moved forward to a word start."""
+    lo, hi = max(0, len(text) - 16 * n_tokens), len(text)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count_tokens(text[mid:], model) <= n_tokens:
+            hi = mid
+        else:
+            lo = mid + 1
+    if 0 < lo < len(text) and not text[lo - 1].isspace():
+        ws = next((i for i in range(lo, min(len(text), lo + 16)) if text[i].isspace()), None)
+        if ws is not None:
+            lo = ws + 1
+    return lo
+
+def _chunk_paragraphs(
+    paragraphs: Iterable[Tuple[int, str]],
+    max_chars: int,
+    overlap: int,
+    max_tokens: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+    unit: str = UNIT_CHARS,
+) -> Iterator[Dict]:
+    # max_chars/overlap are in `unit`: characters (simple_chunks) or tokens (token_chunks).
+    # In character mode `size` follows simple_chunks' original accounting exactly, so chunk
+    # texts never change for documents without oversize paragraphs.
+    # Paragraph sources are kept per piece; only a carried-over tail needs a span list, and
+    # that is built by walking back from the end of the chunk (O(overlap), not O(chunk)).
+    by_tokens = unit == UNIT_TOKENS
+    sep = 1 if by_tokens else 2
+    # A token is at least one character, so a character budget that already fits the token
+    # ceiling needs no token counting for it (the same holds trivially in token mode).
+    if max_tokens is not None and max_chars + overlap + sep <= max_tokens:
+        max_tokens = None
+    # room for a piece after the carried-over tail; with a ceiling smaller than the
+    # overlap, pieces keep half of it and the tail is trimmed to fit instead
+    piece_tokens = max(max_tokens // 2, max_tokens - overlap - 2, 1) if max_tokens is not None else None
+    if by_tokens:
+        piece_tokens = min(piece_tokens or max_chars, max_chars)
+        piece_chars = sys.maxsize
+    else:
+        piece_chars = max_chars
+
+    def count(t: str) -> int:
+        return count_tokens(t, model) if (by_tokens or max_tokens is not None) else 0
+
+    def measure(t: str, ntok: int) -> int:
+        return ntok if by_tokens else len(t)
+
+    def emit(chunk_id: int, text: str, start: int, end: int) -> Dict:
+        return {"chunk_id": chunk_id, "text": text, "start": start, "end": end, "tokens": count_tokens(text, model)}
+
+    texts: List[str] = []
+    srcs: List[int] = []     # source offset per piece; -1 marks the carried-over tail
+    tail_spans: Spans = []
+    size = 0
+    ntok = 0
+    chunk_id = 0
+
+    for para_src, para in paragraphs:
+        for src, p in _split_oversize(para_src, para, piece_chars, piece_tokens, model):
+            t = count(p)
+            m = measure(p, t)
+            if size + m + sep <= max_chars and (max_tokens is None or ntok + t + 1 <= max_tokens):
+                texts.append(p)
+                srcs.append(src)
+                size += m + sep
+                ntok += t + 1
+                continue
+            if texts:
+                text = "\n\n".join(texts)
+                start = tail_spans[0][1] if srcs[0] < 0 else srcs[0]
+                yield emit(chunk_id, text, start, srcs[-1] + len(texts[-1]))
+                chunk_id += 1
+                if overlap <= 0:
+                    cut = len(text)
+                elif by_tokens:
+                    cut = _token_suffix_cut(text, overlap, model)
+                else:
+                    cut = max(0, len(text) - overlap)
+                if max_tokens is not None:
+                    # trim the tail from the left until tail + piece fits the ceiling
+                    room = max_tokens - 1 - t
+                    while cut < len(text) and count(text[cut:]) > room:
+                        keep = (len(text) - cut) * max(room, 0) // count(text[cut:])
+                        cut = len(text) - max(0, min(keep, len(text) - cut - 1))
+                if cut < len(text):
+                    spans: Spans = []
+                    at = len(text)
+                    for tx, s in zip(reversed(texts), reversed(srcs)):
+                        at -= len(tx)
+                        runs = tail_spans if s < 0 else [(0, s, len(tx))]
+                        for q, rs, n in reversed(runs):
+                            if at + q + n > cut:
+                                skip = max(0, cut - at - q)
+                                spans.append((at + q + skip - cut, rs + skip, n - skip))
+                        at -= 2
+                        if at < cut:
+                            break
+                    spans.reverse()
+                    tail_spans = spans
+                    texts, srcs = [text[cut:], p], [-1, src]
+                    tail_tokens = count(texts[0])
+                    size = measure(texts[0], tail_tokens) + sep + m
+                    ntok = tail_tokens + 1 + t
+                    continue
+            texts, srcs, size, ntok = [p], [src], m, t
+    if texts:
+        start = tail_spans[0][1] if srcs[0] < 0 else srcs[0]
+        yield emit(chunk_id, "\n\n".join(texts), start, srcs[-1] + len(texts[-1]))
+
+def simple_chunks(
+    text: str,
+    max_chars: int = 3500,
+    overlap: int = 300,
+    max_tokens: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+) -> List[Dict]:
     """
     Split text into overlapping chunks at paragraph boundaries.
     - max_chars: soft limit per chunk
     - overlap: carry last N chars from previous chunk to next
+    - max_tokens: optional hard ceiling per chunk (tokens of `model`)
+    A paragraph that alone exceeds max_chars (or the token ceiling) is split at line
+    breaks, then sentence ends, then hard boundaries, instead of becoming one giant chunk.
+    Each chunk also carries its start/end character offsets in `text` and its token count
+    (see stream_chunks).
     """
-    paras = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
-    chunks, cur, size = [], [], 0
-    for p in paras:
-        if size + len(p) + 2 <= max_chars:
-            cur.append(p); size += len(p) + 2
-        else:
-            if cur:
-                chunks.append("\n\n".join(cur))
-            tail = "\n\n".join(cur)[-overlap:] if cur and overlap > 0 else ""
-            cur = [tail, p] if tail else [p]
-            size = len("\n\n".join(cur))
-    if cur:
-        chunks.append("\n\n".join(cur))
-    return [{"chunk_id": i, "text": c} for i, c in enumerate(chunks)]
+    return list(_chunk_paragraphs(_text_paragraphs(text), max_chars, overlap, max_tokens, model))
 
+def token_chunks(
+    text: str,
+    target_tokens: int = 800,
+    overlap_tokens: int = 80,
+    max_tokens: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+) -> List[Dict]:
+    """
+    simple_chunks() measured in tokens of `model` (token_utils; exact with tiktoken):
+    paragraphs are packed up to target_tokens, the last ~overlap_tokens tokens (from a
+    word start) carry over, and oversize paragraphs are split as in simple_chunks.
+    Token counts stay even across prose and numeric tables, unlike character budgets.
+    """
+    return list(_chunk_paragraphs(_text_paragraphs(text), target_tokens, overlap_tokens, max_tokens, model, unit=UNIT_TOKENS))
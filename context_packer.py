@@ -0,0 +1,147 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from token_utils import count_tokens
+
+PACK_GREEDY = "greedy"
+PACK_KNAPSACK = "knapsack"
+_MIN_OVERLAP = 16       # shorter suffix/prefix matches are coincidence, not chunk overlap
+_KNAPSACK_CELLS = 512   # budget is quantised to at most this many DP columns
+
+class Snippet(NamedTuple):
+    filename: str
+    chunk_id: int
+    text: str
+    start: Optional[int] = None  # source char offsets (chunk metadata char_start/char_end)
+    end: Optional[int] = None
+
+class Span(NamedTuple):
+    """One or more consecutive chunks of a file, overlap removed, as sent to the model."""
+    filename: str
+    first_chunk: int
+    last_chunk: int
+    text: str
+
+def overlap_len(a: str, b: str, max_overlap: int) -> int:
+    """Length of the longest suffix of `a` that `b` starts with (simple_chunks carries it over)."""
+    for n in range(min(len(a), len(b), max_overlap), _MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+def seam(prev: Snippet, nxt: Snippet) -> int:
+    """
+    Characters of nxt's text that repeat the end of prev's. The source offsets say
+    whether the chunks overlap at all; the text then gives the exact length, whatever
+    the chunker's overlap setting (characters or tokens) was.
+    """
+    if prev.end is not None and nxt.start is not None and nxt.start >= prev.end:
+        return 0
+    return overlap_len(prev.text, nxt.text, min(len(prev.text), len(nxt.text)))
+
+def merge_adjacent(snippets: Sequence[Snippet]) -> List[Span]:
+    """
+    Merge runs of consecutive chunk ids from the same file into one span, dropping the
+    text the next chunk repeats. Spans keep the order of their best-ranked member.
+    """
+    order: Dict[Tuple[str, int], int] = {}
+    by_file: Dict[str, List[Snippet]] = {}
+    for rank, s in enumerate(snippets):
+        order.setdefault((s.filename, s.chunk_id), rank)
+        by_file.setdefault(s.filename, []).append(s)
+
+    ranked: List[Tuple[int, Span]] = []
+    for fname, group in by_file.items():
+        group = sorted({s.chunk_id: s for s in group}.values(), key=lambda s: s.chunk_id)
+        run = [group[0]]
+        for s in group[1:] + [None]:
+            if s is not None and s.chunk_id == run[-1].chunk_id + 1:
+                run.append(s)
+                continue
+            text = run[0].text
+            for prev, nxt in zip(run, run[1:]):
+                cut = seam(prev, nxt)
+                text += (nxt.text[cut:] if cut else "\n\n" + nxt.text)
+            best = min(order[(fname, r.chunk_id)] for r in run)
+            ranked.append((best, Span(fname, run[0].chunk_id, run[-1].chunk_id, text)))
+            run = [s]
+    return [span for _, span in sorted(ranked, key=lambda t: t[0])]
+
+def select_greedy(costs: Sequence[int], budget: int) -> List[int]:
+    """Take items in rank order, skipping any that no longer fit (later, smaller ones still can)."""
+    chosen, used = [], 0
+    for i, c in enumerate(costs):
+        if used + c <= budget:
+            chosen.append(i)
+            used += c
+    return chosen
+
+def select_knapsack(costs: Sequence[int], weights: Sequence[float], budget: int) -> List[int]:
+    """0/1 knapsack maximising total weight under the token budget (costs rounded up, so never over)."""
+    if budget <= 0 or not costs:
+        return []
+    q = max(1, -(-budget // _KNAPSACK_CELLS))
+    cap = budget // q
+    qc = [-(-int(c) // q) for c in costs]
+    best = np.zeros(cap + 1)
+    take = np.zeros((len(qc), cap + 1), dtype=bool)
+    for i, (c, w) in enumerate(zip(qc, weights)):
+        if c > cap:
+            continue
+        cand = np.full(cap + 1, -np.inf)
+        cand[c:] = best[:cap + 1 - c] + w
+        take[i] = cand > best
+        best = np.maximum(best, cand)
+    chosen, b = [], cap
+    for i in range(len(qc) - 1, -1, -1):
+        if take[i, b]:
+            chosen.append(i)
+            b -= qc[i]
+    return sorted(chosen)
+
+def pack(
+    snippets: Sequence[Snippet],
+    render: Callable[[Span], str],
+    budget: int,
+    model: str,
+    mode: str = PACK_GREEDY,
+) -> List[Span]:
+    """
+    Choose snippets (given best-first) so the rendered spans fit in `budget` tokens.
+    Each snippet is weighted 1/(rank+1); greedy keeps rank order, knapsack maximises
+    total weight. Merging neighbours frees the repeated overlap, and the freed room is
+    topped up with the best remaining snippets.
+    """
+    if not snippets or budget <= 0:
+        return []
+    tokens = lambda spans: sum(count_tokens(render(s), model) for s in spans)
+    costs = [count_tokens(render(Span(s.filename, s.chunk_id, s.chunk_id, s.text)), model) for s in snippets]
+    if mode == PACK_KNAPSACK:
+        chosen = select_knapsack(costs, [1.0 / (r + 1) for r in range(len(snippets))], budget)
+    else:
+        chosen = select_greedy(costs, budget)
+
+    picked = set(chosen)
+    spans = merge_adjacent([snippets[i] for i in sorted(picked)])
+    used = tokens(spans)
+    by_chunk = {(s.filename, s.chunk_id): s for s in snippets}
+    for i, s in enumerate(snippets):
+        if i in picked or costs[i] > budget:
+            continue
+        # merging can save at most this snippet's own header plus the text it shares with its neighbours
+        saving = count_tokens(render(Span(s.filename, s.chunk_id, s.chunk_id, "")), model)
+        prev, nxt = by_chunk.get((s.filename, s.chunk_id - 1)), by_chunk.get((s.filename, s.chunk_id + 1))
+        if prev is not None:
+            saving += count_tokens(s.text[:seam(prev, s)], model) + 1
+        if nxt is not None:
+            cut = seam(s, nxt)
+            saving += count_tokens(s.text[len(s.text) - cut:], model) + 1 if cut else 0
+        if costs[i] - saving > budget - used:
+            continue
+        trial = merge_adjacent([snippets[j] for j in sorted(picked | {i})])
+        trial_used = tokens(trial)
+        if trial_used <= budget:
+            picked.add(i)
+            spans, used = trial, trial_used
+    return spans
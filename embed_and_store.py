@@ -1,32 +1,31 @@
 import os
 import time
-import pickle
+import json
+import hashlib
 import re
+import shutil
 import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Iterator, Optional, List, Tuple
 
 import numpy as np
 import faiss
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-from chunk_utils import simple_chunks
+import llm_client
+from chunk_utils import UNIT_CHARS, UNIT_TOKENS, stream_chunks, stream_token_chunks
+from token_utils import count_tokens, has_tokenizer
+from rate_limit import RateLimiter, is_rate_limit_error, retry_after_seconds
+from embedding_cache import EmbeddingCache
+from meta_store import ColumnarMetadata, write_store
+from text_store import ChunkTexts, TextWriter, TextTable, read_table, write_table
+from lexical_index import build_index as build_lexical_index
 
 load_dotenv()
 
-# Prefer new SDK, fallback to legacy
-try:
-    from openai import OpenAI
-    _client = OpenAI()
-    _use_client = True
-except Exception:
-    _client = None
-    _use_client = False
-    import openai
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-
 PARSED_DIR = Path("parsed_data")
 EMBED_DIR = Path("embeddings")
 EMBED_DIR.mkdir(parents=True, exist_ok=True)
@@ -34,14 +33,56 @@ EMBED_DIR.mkdir(parents=True, exist_ok=True)
 EMBED_MODEL = "text-embedding-3-small"
 EMBED_DIM = 1536
 INDEX_PATH = EMBED_DIR / "faiss.index"
-META_PATH = EMBED_DIR / "metadata.pkl"
+META_PATH = EMBED_DIR / "metadata.col"          # columnar, mmap-able (meta_store.ColumnarMetadata)
+LEGACY_META_PATH = EMBED_DIR / "metadata.pkl"     # pickled dict written by builds before metadata.col
+TEXT_BLOB_PATH = EMBED_DIR / "chunks.bin"       # full chunk texts, append-only
+TEXT_TABLE_PATH = EMBED_DIR / "chunks.idx"      # vector id -> offset/length in chunks.bin
 REPORT_CSV = EMBED_DIR / "embedding_report.csv"
+MANIFEST_PATH = EMBED_DIR / "manifest.json"
+GENERATION_PATH = EMBED_DIR / "GENERATION"  # rewritten last on publish; readers hot-reload when it changes
+LEXICAL_PREFIX = "lexical-"                 # BM25 postings live in embeddings/lexical-<generation>/
+LEXICAL_KEEP = 2                            # generations kept on disk for readers still on the old one
+CACHE_PATH = EMBED_DIR / "embed_cache.sqlite"
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000"))
+
+# Per-request limits of the embeddings endpoint
+EMBED_MAX_INPUT_TOKENS = 8191
+EMBED_BATCH_MAX_ITEMS = 2048
+EMBED_BATCH_MAX_TOKENS = 300_000
+
+# Concurrency + account quota for the embedding scheduler (override via env)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+EMBED_RPM = float(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = float(os.getenv("EMBED_TPM", "1000000"))
+EMBED_MAX_ATTEMPTS = 4   # failed API calls per single chunk before it is skipped
+EMBED_MAX_ROUNDS = 20    # rate-limited re-queues before the remaining chunks are skipped
+# Chunks embedded and written out per group; bounds a refresh's memory (a few batches' worth)
+EMBED_FLUSH_CHUNKS = int(os.getenv("EMBED_FLUSH_CHUNKS", "8192"))
+
+_limiter = RateLimiter(EMBED_RPM, EMBED_TPM)
+_cache = EmbeddingCache(CACHE_PATH, EMBED_MODEL, EMBED_DIM, max_entries=EMBED_CACHE_MAX_ENTRIES)
 
 _base_index = faiss.IndexFlatL2(EMBED_DIM)
 _index = faiss.IndexIDMap2(_base_index)
 
-_metadata: Dict[int, Dict] = {}
-_next_id = 0
+_store: Optional[ColumnarMetadata] = None  # published metadata being patched (None on a full rebuild)
+_dropped: set = set()          # ids of _store removed this run
+_metadata: Dict[int, Dict] = {}  # rows added this run (their texts go straight to chunks.bin)
+
+_ID_MASK = (1 << 63) - 1  # FAISS ids are int64; keep them non-negative
+
+# Anything that changes how a file maps to vectors; a mismatch forces a full rebuild
+CHUNK_MAX_CHARS = 3500
+CHUNK_OVERLAP = 300
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(EMBED_MAX_INPUT_TOKENS)))  # hard ceiling per chunk
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", UNIT_CHARS).lower()  # chars | tokens
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "800"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "80"))
+if CHUNK_UNIT == UNIT_TOKENS:
+    _CHUNKING = f"token_chunks:{CHUNK_TARGET_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{CHUNK_MAX_TOKENS}"
+else:
+    _CHUNKING = f"simple_chunks:{CHUNK_MAX_CHARS}:{CHUNK_OVERLAP}:{CHUNK_MAX_TOKENS}"
+INDEX_SIGNATURE = {"model": EMBED_MODEL, "dim": EMBED_DIM, "chunking": _CHUNKING, "ids": "blake2b63", "texts": "chunks.bin"}
 
 _CANON_MEETING = re.compile(r'^(?P<y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2})_Meeting-Summary', re.IGNORECASE)
 ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
@@ -88,33 +129,323 @@ def _extract_headers(text: str) -> dict:
             out["valid_to"] = _coerce_iso(ln.split(":", 1)[1])
     return out
 
-def _embed_client(text: str) -> np.ndarray:
-    resp = _client.embeddings.create(model=EMBED_MODEL, input=text)
-    return np.asarray(resp.data[0].embedding, dtype=np.float32)
+def get_embedding(text: str) -> Optional[np.ndarray]:
+    cached = _cache.get(text)
+    if cached is not None:
+        return cached
+    try:
+        # retries, backoff and deadlines live in the shared client
+        arr = llm_client.embed(EMBED_MODEL, [text])[0]
+        if arr.shape != (EMBED_DIM,):
+            raise ValueError(f"Unexpected embedding shape {arr.shape}")
+    except Exception as e:
+        print(f"Failed to embed: {e}")
+        return None
+    _cache.put(text, arr)
+    return arr
+
+ChunkKey = Tuple[str, int]  # (filename, chunk_id)
 
-def _embed_legacy(text: str) -> np.ndarray:
-    resp = openai.Embedding.create(model=EMBED_MODEL, input=text)  # type: ignore
-    return np.asarray(resp["data"][0]["embedding"], dtype=np.float32)
+def _pack_batches(items: List[Tuple[ChunkKey, str, int]], max_items: int, max_tokens: int) -> List[List[Tuple[ChunkKey, str, int]]]:
+    """Greedily pack (key, text, tokens) items into batches under both limits."""
+    batches, cur, cur_tokens = [], [], 0
+    for item in items:
+        ntok = item[2]
+        if cur and (len(cur) >= max_items or cur_tokens + ntok > max_tokens):
+            batches.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(item)
+        cur_tokens += ntok
+    if cur:
+        batches.append(cur)
+    return batches
 
-def get_embedding(text: str) -> Optional[np.ndarray]:
-    for attempt in range(4):
-        try:
-            arr = _embed_client(text) if _use_client else _embed_legacy(text)
-            if arr.shape != (EMBED_DIM,):
-                raise ValueError(f"Unexpected embedding shape {arr.shape}")
-            return arr
-        except Exception as e:
-            wait = 1.5 ** attempt
-            print(f"Embedding error (attempt {attempt + 1}): {e}. Retrying in {wait:.1f}s...")
+def _embed_one_batch(batch: List[Tuple[ChunkKey, str, int]]) -> Tuple[List[Tuple[ChunkKey, np.ndarray]], List[Tuple[ChunkKey, str, int]], bool]:
+    """Worker: embed one batch under the shared limiter. Returns (embedded, failed, rate_limited)."""
+    texts = [t for _, t, _ in batch]
+    _limiter.acquire(sum(n for _, _, n in batch))
+    try:
+        # the scheduler below owns retries and throttling, so the client makes a single
+        # attempt and stays out of the breaker interactive queries share
+        vecs = llm_client.embed(EMBED_MODEL, texts, retries=0, guarded=False)
+        if len(vecs) != len(batch):
+            raise ValueError(f"Expected {len(batch)} embeddings, got {len(vecs)}")
+    except Exception as e:
+        if is_rate_limit_error(e):
+            _limiter.on_rate_limit(retry_after_seconds(e))
+            return [], list(batch), True
+        print(f"Embedding error on batch of {len(batch)}: {e}")
+        return [], list(batch), False
+    _limiter.on_success()
+
+    done, failed = [], []
+    for item, arr in zip(batch, vecs):
+        if arr.shape != (EMBED_DIM,):
+            print(f"Unexpected embedding shape {arr.shape} for chunk {item[0][1]} of {item[0][0]}")
+            failed.append(item)
+        else:
+            done.append((item[0], arr))
+    return done, failed, False
+
+def get_embeddings_batch(items: List[Tuple[ChunkKey, str]], cache_hits: Optional[set] = None) -> Dict[ChunkKey, np.ndarray]:
+    """
+    Embed many chunks with as few API round trips as possible.
+      - items: ((filename, chunk_id), text) pairs
+      - returns {(filename, chunk_id): vector} for every chunk that embedded
+      - cache_hits: if given, collects the keys served from the on-disk cache
+    Chunks already in the embedding cache never reach the API.
+    Batches run on up to EMBED_CONCURRENCY threads sharing one RPM/TPM limiter.
+    Rate-limited batches are retried as-is once the limiter's cooldown passes;
+    batches that fail for other reasons are bisected until the bad input is alone,
+    so only chunks that fail on their own (EMBED_MAX_ATTEMPTS times) are skipped.
+    """
+    out: Dict[ChunkKey, np.ndarray] = {}
+    cached = _cache.get_many(text for _, text in items)
+    exact = has_tokenizer(EMBED_MODEL)
+    pending: List[Tuple[ChunkKey, str, int]] = []
+    for key, text in items:
+        if text in cached:
+            out[key] = cached[text]
+            if cache_hits is not None:
+                cache_hits.add(key)
+            continue
+        ntok = count_tokens(text, EMBED_MODEL)
+        if exact and ntok > EMBED_MAX_INPUT_TOKENS:
+            print(f"Skipping chunk {key[1]} of {key[0]}: {ntok} tokens exceeds the model limit.")
+            continue
+        pending.append((key, text, ntok))
+
+    texts_by_key = {key: text for key, text, _ in pending}
+    batches = _pack_batches(pending, EMBED_BATCH_MAX_ITEMS, EMBED_BATCH_MAX_TOKENS)
+    failures: Dict[ChunkKey, int] = {}  # failed calls of a chunk sent on its own
+    rounds = 0
+    given_up: List[Tuple[ChunkKey, str, int]] = []
+    while batches and rounds < EMBED_MAX_ROUNDS:
+        throttled: List[Tuple[ChunkKey, str, int]] = []
+        retry: List[List[Tuple[ChunkKey, str, int]]] = []
+        with ThreadPoolExecutor(max_workers=max(1, min(EMBED_CONCURRENCY, len(batches)))) as pool:
+            futures = [pool.submit(_embed_one_batch, b) for b in batches]
+            for fut in tqdm(as_completed(futures), total=len(futures), desc="Embedding batches", disable=len(futures) < 2):
+                done, failed, rate_limited = fut.result()
+                out.update(done)
+                _cache.put_many((texts_by_key[key], vec) for key, vec in done)
+                if rate_limited:
+                    throttled.extend(failed)
+                elif len(failed) > 1:
+                    # bisect; splitting is not an attempt, only a chunk failing alone is
+                    half = len(failed) // 2
+                    retry += [failed[:half], failed[half:]]
+                elif failed:
+                    key = failed[0][0]
+                    failures[key] = failures.get(key, 0) + 1
+                    if failures[key] >= EMBED_MAX_ATTEMPTS:
+                        given_up.extend(failed)
+                    else:
+                        retry.append(failed)
+
+        if throttled:
+            rounds += 1
+            print(f"Rate limited; re-queueing {len(throttled)} chunk(s).")
+        alone = [failures[b[0][0]] for b in retry if len(b) == 1 and b[0][0] in failures]
+        if alone:
+            wait = 1.5 ** max(alone)
+            print(f"Retrying {sum(len(b) for b in retry)} failed chunk(s) in {wait:.1f}s...")
             time.sleep(wait)
-    print("Failed to embed after retries.")
-    return None
+        batches = retry + _pack_batches(throttled, EMBED_BATCH_MAX_ITEMS, EMBED_BATCH_MAX_TOKENS)
+
+    pending = [item for b in batches for item in b]
+    for (fname, cid), _, _ in given_up + pending:
+        print(f"Skipping chunk {cid} of {fname} due to embedding failure.")
+    return out
 
 def add_to_index(vec: np.ndarray, vid: int) -> None:
     _index.add_with_ids(vec.reshape(1, -1), np.array([vid], dtype=np.int64))
 
-def main():
-    global _next_id
+def vector_id(filename: str, chunk_id: int, taken: Optional[Dict[int, Tuple[str, int]]] = None) -> int:
+    """
+    Stable 63-bit id for (parsed filename, chunk index), identical across rebuilds.
+    `taken` maps ids already in use to their (filename, chunk_id); on a collision
+    with a different chunk we re-hash with a salt and warn, so ids never alias.
+    """
+    key = (filename, int(chunk_id))
+    salt = 0
+    while True:
+        raw = f"{filename}\0{int(chunk_id)}" + (f"\0{salt}" if salt else "")
+        vid = int.from_bytes(hashlib.blake2b(raw.encode("utf-8"), digest_size=8).digest(), "big") & _ID_MASK
+        owner = taken.get(vid) if taken is not None else None
+        if owner is None or owner == key:
+            return vid
+        print(f"⚠️ Vector id collision between {owner} and {key}; re-hashing.")
+        salt += 1
+
+class _IdOwners(dict):
+    """
+    vector_id's `taken` map for a refresh: ids added this run, falling back to the
+    published store (minus dropped ids), whose rows are decoded only on a hit.
+    """
+    def get(self, vid, default=None):
+        owner = super().get(vid)
+        if owner is None and _store is not None and vid not in _dropped and vid in _store:
+            meta = _store[vid]
+            owner = (meta["filename"], int(meta["chunk_id"]))
+        return default if owner is None else owner
+
+def _file_sha256(fp: Path) -> str:
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _load_manifest() -> Dict:
+    if not MANIFEST_PATH.exists():
+        return {}
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable manifest ({e}); rebuilding from scratch.")
+        return {}
+
+def _load_previous_state(manifest: Dict) -> bool:
+    """
+    Load the published index + metadata into the module globals so main() can patch them.
+    The metadata stays a mmap'd ColumnarMetadata; its rows are not decoded.
+    Returns False (leaving a fresh, empty index) when there is nothing compatible to patch.
+    """
+    global _index, _store, _dropped, _metadata
+    _index = faiss.IndexIDMap2(faiss.IndexFlatL2(EMBED_DIM))
+    _store, _dropped, _metadata = None, set(), {}
+    if manifest.get("signature") != INDEX_SIGNATURE or not INDEX_PATH.exists() or not META_PATH.exists():
+        return False
+    try:
+        index = faiss.read_index(str(INDEX_PATH))
+        store = ColumnarMetadata(META_PATH)
+    except Exception as e:
+        print(f"⚠️ Could not load previous index ({e}); rebuilding from scratch.")
+        return False
+    if index.d != EMBED_DIM or index.ntotal != len(store):
+        print("⚠️ Previous index and metadata disagree; rebuilding from scratch.")
+        return False
+    table = read_table(TEXT_TABLE_PATH)
+    if table is None or not np.array_equal(table.ids, store.ids):
+        print("⚠️ Chunk text store does not match the index; rebuilding from scratch.")
+        return False
+    _index, _store = index, store
+    return True
+
+def _load_previous_report() -> Dict[str, Dict]:
+    if not REPORT_CSV.exists():
+        return {}
+    with open(REPORT_CSV, newline="", encoding="utf-8") as f:
+        return {row["filename"]: row for row in csv.DictReader(f)}
+
+def _atomic_replace(path: Path, write) -> None:
+    """Write via `write(tmp_path)` then rename over `path`, so readers never see a partial file."""
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+def _chunk_file(fp: Path) -> Iterator[Dict]:
+    """Chunks of a parsed file, streamed line by line (start/end are char offsets into the file)."""
+    with open(fp, encoding="utf-8") as f:
+        if CHUNK_UNIT == UNIT_TOKENS:
+            yield from stream_token_chunks(
+                f, target_tokens=CHUNK_TARGET_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, max_tokens=CHUNK_MAX_TOKENS, model=EMBED_MODEL,
+            )
+        else:
+            yield from stream_chunks(
+                f, max_chars=CHUNK_MAX_CHARS, overlap=CHUNK_OVERLAP, max_tokens=CHUNK_MAX_TOKENS, model=EMBED_MODEL,
+            )
+
+def _read_head(fp: Path, n: int = 25) -> str:
+    """First n lines after any leading blank lines: what _extract_headers saw of the stripped text."""
+    lines: List[str] = []
+    with open(fp, encoding="utf-8") as f:
+        for line in f:
+            if not lines:
+                line = line.lstrip()
+                if not line:
+                    continue
+            lines.append(line)
+            if len(lines) >= n:
+                break
+    return "".join(lines)
+
+def _lexical_docs(store: ColumnarMetadata, texts: ChunkTexts):
+    """(vector_id, text) for every indexed chunk, read back from the chunk text store."""
+    for vid, title, filename in zip(store.ids.tolist(), store.values("title"), store.values("filename")):
+        yield vid, f"{title or ''} {filename or ''}\n{texts.get(vid, '')}"
+
+def _has_lexical_index() -> bool:
+    """True when the published generation already has its BM25 postings (older builds don't)."""
+    try:
+        generation = GENERATION_PATH.read_text(encoding="utf-8").strip()
+    except OSError:
+        return False
+    return (EMBED_DIR / f"{LEXICAL_PREFIX}{generation}").is_dir()
+
+def _publish_lexical(generation: str, store: ColumnarMetadata) -> None:
+    """BM25 postings for this generation, built from the chunk text table written just before."""
+    texts = ChunkTexts(TEXT_BLOB_PATH, TEXT_TABLE_PATH)
+    try:
+        build_lexical_index(EMBED_DIR / f"{LEXICAL_PREFIX}{generation}", _lexical_docs(store, texts))
+    finally:
+        texts.close()
+    old = sorted(p for p in EMBED_DIR.glob(f"{LEXICAL_PREFIX}*") if p.is_dir())[:-LEXICAL_KEEP]
+    for d in old:
+        shutil.rmtree(d, ignore_errors=True)
+
+def _publish(manifest: Dict, table: TextTable) -> str:
+    """
+    Atomically publish index + columnar metadata + chunk texts + manifest + BM25
+    index, then bump the generation marker. The metadata is the published store
+    patched with this run's drops and additions.
+    """
+    generation = f"{time.time_ns()}"
+    meta_tmp = META_PATH.with_name(META_PATH.name + ".tmp")
+    write_store(meta_tmp, _metadata, base=_store, drop=_dropped)
+    store = ColumnarMetadata(meta_tmp)
+    _atomic_replace(TEXT_TABLE_PATH, lambda tmp: write_table(tmp, table))
+    _publish_lexical(generation, store)
+    del store
+    _atomic_replace(INDEX_PATH, lambda tmp: faiss.write_index(_index, str(tmp)))
+    os.replace(meta_tmp, META_PATH)
+    _atomic_replace(MANIFEST_PATH, lambda tmp: tmp.write_text(json.dumps(manifest, indent=1), encoding="utf-8"))
+    _atomic_replace(GENERATION_PATH, lambda tmp: tmp.write_text(generation, encoding="utf-8"))
+    LEGACY_META_PATH.unlink(missing_ok=True)  # superseded by metadata.col
+    return generation
+
+def _embed_group(group: List[Tuple[ChunkKey, Dict, Dict]], stats: Dict[str, Dict], writer: TextWriter, taken: Dict) -> None:
+    """Embed a group of (key, chunk, file meta) and add what embedded to the index, metadata and text store."""
+    if not group:
+        return
+    cache_hits: set = set()
+    vectors = get_embeddings_batch([(key, ch["text"]) for key, ch, _ in group], cache_hits=cache_hits)
+    for key, ch, file_meta in group:
+        vec = vectors.get(key)
+        if vec is None:
+            continue
+        vid = vector_id(key[0], key[1], taken)
+        taken[vid] = (key[0], int(key[1]))
+        add_to_index(vec, vid)
+        writer.add(vid, ch["text"])
+        _metadata[vid] = {
+            **file_meta,
+            "chunk_id": ch["chunk_id"],
+            "char_start": ch["start"],
+            "char_end": ch["end"],
+            "tokens": ch["tokens"],
+        }
+        stats[key[0]]["ids"].append(vid)
+        stats[key[0]]["hits"] += key in cache_hits
+    group.clear()
+
+def main(full_rebuild: bool = False):
+    """
+    Incremental refresh: only new or changed files in parsed_data/ are chunked and
+    embedded. Vectors of changed or deleted files are removed from the index, and
+    embeddings/manifest.json records each file's content hash and vector IDs.
+    """
     if not PARSED_DIR.exists():
         print(f"Missing folder: {PARSED_DIR.resolve()}")
         return
@@ -124,59 +455,87 @@ def main():
         print("No .txt files found in parsed_data.")
         return
 
-    print(f"Found {len(files)} files to embed.")
-    report_rows: List[tuple] = [("filename", "folder", "meeting_date", "title", "tags", "valid_from", "valid_to", "chunks", "chars")]
+    manifest = {} if full_rebuild else _load_manifest()
+    old_files: Dict[str, Dict] = manifest.get("files", {}) if manifest.get("signature") == INDEX_SIGNATURE else {}
 
-    for fp in tqdm(files, desc="Embedding"):
-        text = fp.read_text(encoding="utf-8").strip()
-        if not text:
-            print(f"Skipping empty: {fp.name}")
-            continue
+    # Compare hashes before loading anything, so an unchanged corpus costs one read of each file
+    hashes = {fp.name: _file_sha256(fp) for fp in files}
+    todo = [fp for fp in files if old_files.get(fp.name, {}).get("sha256") != hashes[fp.name]]
+    stale = [name for name, entry in old_files.items() if name not in hashes or hashes[name] != entry.get("sha256")]
+    if old_files and not todo and not stale and INDEX_PATH.exists() and META_PATH.exists() and _has_lexical_index():
+        total = sum(len(entry.get("ids", [])) for entry in old_files.values())
+        print(f"✅ Index is up to date ({total} vectors); nothing to embed.")
+        return
+
+    incremental = _load_previous_state(manifest)
+    if not incremental:
+        old_files, todo, stale = {}, files, []
+
+    stale_ids = [vid for name in stale for vid in old_files[name].get("ids", [])]
+    if stale_ids:
+        _index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+        _dropped.update(stale_ids)
+    new_files = {name: entry for name, entry in old_files.items() if name not in stale}
+    taken = _IdOwners()
 
-        headers = _extract_headers(text)
+    print(f"Found {len(files)} files: {len(todo)} new/changed, {len(stale)} changed/deleted to drop.")
+    report_header = ("filename", "folder", "meeting_date", "title", "tags", "valid_from", "valid_to", "chunks", "chars", "tokens", "max_chunk_tokens", "cache_hits", "cache_misses")
+    previous_report = _load_previous_report() if incremental else {}
+    report_by_file: Dict[str, tuple] = {
+        name: tuple(previous_report[name].get(col, "") for col in report_header)
+        for name in new_files if name in previous_report
+    }
+
+    kept = _store.ids[~np.isin(_store.ids, np.asarray(stale_ids, dtype=np.int64))] if _store is not None else []
+    writer = TextWriter(TEXT_BLOB_PATH, TEXT_TABLE_PATH, keep=kept)
+    stats: Dict[str, Dict] = {}  # per file: report counters and the ids it got
+    group: List[Tuple[ChunkKey, Dict, Dict]] = []
+    for fp in tqdm(todo, desc="Chunking + embedding", disable=not todo):
+        headers = _extract_headers(_read_head(fp))
         folder_label = headers["folder"]
         orig_name = headers["original_file"] or fp.name
+        file_meta = {
+            "filename": fp.name,
+            "path": str(fp),
+            "folder": folder_label,
+            "meeting_date": _date_from_filename(orig_name) if folder_label.lower() == "meetings" else None,
+            "title": headers["title"],
+            "tags": headers["tags"],
+            "valid_from": headers["valid_from"],
+            "valid_to": headers["valid_to"],
+        }
+        st = stats[fp.name] = {"meta": file_meta, "chunks": 0, "chars": 0, "tokens": 0, "max_tokens": 0, "hits": 0, "ids": []}
+        for ch in _chunk_file(fp):
+            st["chunks"] += 1
+            st["chars"] += len(ch["text"])
+            st["tokens"] += ch["tokens"]
+            st["max_tokens"] = max(st["max_tokens"], ch["tokens"])
+            group.append(((fp.name, ch["chunk_id"]), ch, file_meta))
+            if len(group) >= EMBED_FLUSH_CHUNKS:
+                _embed_group(group, stats, writer, taken)
+        if not st["chunks"]:
+            print(f"Skipping empty: {fp.name}")
+            del stats[fp.name]
+    _embed_group(group, stats, writer, taken)
+    table = writer.close()
+
+    for name, st in stats.items():
+        m = st["meta"]
+        report_by_file[name] = (name, m["folder"] or "", m["meeting_date"] or "", m["title"], ";".join(m["tags"]), m["valid_from"] or "", m["valid_to"] or "", st["chunks"], st["chars"], st["tokens"], st["max_tokens"], st["hits"], st["chunks"] - st["hits"])
+        # A partially embedded file keeps no hash, so the next refresh retries it
+        complete = len(st["ids"]) == st["chunks"]
+        new_files[name] = {"sha256": hashes[name] if complete else None, "ids": st["ids"]}
 
-        meeting_date_iso = _date_from_filename(orig_name) if folder_label.lower() == "meetings" else None
-        title = headers["title"]
-        tags = headers["tags"]
-        valid_from = headers["valid_from"]
-        valid_to = headers["valid_to"]
-
-        chunks = simple_chunks(text, max_chars=3500, overlap=300) or [{"chunk_id": 0, "text": text[:3500]}]
-        total_chars = sum(len(ch["text"]) for ch in chunks)
-        report_rows.append((fp.name, folder_label or "", meeting_date_iso or "", title, ";".join(tags), valid_from or "", valid_to or "", len(chunks), total_chars))
-
-        for ch in chunks:
-            vec = get_embedding(ch["text"])
-            if vec is None:
-                print(f"Skipping chunk {ch['chunk_id']} of {fp.name} due to embedding failure.")
-                continue
-            add_to_index(vec, _next_id)
-            _metadata[_next_id] = {
-                "filename": fp.name,
-                "path": str(fp),
-                "chunk_id": ch["chunk_id"],
-                "text_preview": ch["text"][:1000],
-                "folder": folder_label,
-                "meeting_date": meeting_date_iso,
-                "title": title,
-                "tags": tags,
-                "valid_from": valid_from,
-                "valid_to": valid_to,
-            }
-            _next_id += 1
-
-    faiss.write_index(_index, str(INDEX_PATH))
-    with open(META_PATH, "wb") as f:
-        pickle.dump(_metadata, f)
+    generation = _publish({"signature": INDEX_SIGNATURE, "files": new_files}, table)
 
     with open(REPORT_CSV, "w", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerows(report_rows)
+        csv.writer(f).writerows([report_header] + [report_by_file[name] for name in sorted(report_by_file)])
 
-    print(f"✅ Saved FAISS index to {INDEX_PATH}")
-    print(f"✅ Saved metadata for {len(_metadata)} vectors to {META_PATH}")
+    print(f"✅ Saved FAISS index to {INDEX_PATH} (generation {generation})")
+    print(f"✅ Saved metadata for {_index.ntotal} vectors to {META_PATH}")
     print(f"📝 Wrote embedding health report to {REPORT_CSV}")
+    hits = sum(st["hits"] for st in stats.values())
+    print(f"🗃️ Embedding cache: {hits} hit(s), {sum(len(st['ids']) for st in stats.values()) - hits} newly embedded")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_SQL_VARS = 500  # stay well under SQLite's bound-parameter limit
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache in a single SQLite file.
+    - key: sha256(model, dim, text) so a model/dimension change never serves stale vectors
+    - value: raw float32 bytes
+    - bounded by max_entries; least-recently-used rows are evicted after writes
+    hits/misses count lookups since the cache was opened.
+    """
+    def __init__(self, path: Path, model: str, dim: int, max_entries: int = 100_000):
+        self.path = Path(path)
+        self.model = model
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        h = hashlib.sha256()
+        h.update(f"{self.model}\0{self.dim}\0".encode("utf-8"))
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return {text: vector} for the texts already cached."""
+        by_key = {self.key(t): t for t in texts}
+        keys = list(by_key)
+        found: Dict[str, np.ndarray] = {}
+        now = int(time.time())
+        with self._lock:
+            for i in range(0, len(keys), _SQL_VARS):
+                part = keys[i:i + _SQL_VARS]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for k, blob in rows:
+                    arr = np.frombuffer(blob, dtype=np.float32)
+                    if arr.shape == (self.dim,):
+                        found[by_key[k]] = arr.copy()
+                hit_keys = [(now, k) for k, _ in rows]
+                if hit_keys:
+                    self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", hit_keys)
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self.get_many([text]).get(text)
+
+    def put_many(self, pairs: Iterable[Tuple[str, np.ndarray]]) -> None:
+        now = int(time.time())
+        rows: List[tuple] = [
+            (self.key(t), np.asarray(v, dtype=np.float32).tobytes(), now) for t, v in pairs
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)", rows)
+            self._evict()
+            self._conn.commit()
+
+    def put(self, text: str, vec: np.ndarray) -> None:
+        self.put_many([(text, vec)])
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    """Case-, width- and whitespace-insensitive form of a query, minus trailing punctuation."""
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    s = _WS_RE.sub(" ", s).strip()
+    return s.strip(" ?!.,;:")
+
+class QueryEmbeddingCache:
+    """
+    Two-level cache for query embeddings keyed on (model, normalize_query(text)):
+    an in-process LRU in front of an EmbeddingCache file that survives restarts.
+    The disk level is optional: if it can't be opened we carry on memory-only.
+    """
+    def __init__(self, path: Path, model: str, dim: int, max_memory: int = 2048, max_disk: int = 50_000):
+        self.path = Path(path)
+        self.model, self.dim = model, dim
+        self.max_memory, self.max_disk = max_memory, max_disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._store: Optional[EmbeddingCache] = None
+        self._store_failed = False
+
+    def _disk(self) -> Optional[EmbeddingCache]:
+        if self._store is None and not self._store_failed:
+            try:
+                self._store = EmbeddingCache(self.path, self.model, self.dim, max_entries=self.max_disk)
+            except Exception as e:
+                print(f"⚠️ Query cache on disk unavailable ({e}); using memory only.")
+                self._store_failed = True
+        return self._store
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_memory:
+            self._lru.popitem(last=False)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = normalize_query(text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return vec
+        store = self._disk()
+        vec = None
+        if store is not None:
+            try:
+                vec = store.get(key)
+            except Exception as e:
+                print(f"⚠️ Query cache lookup failed: {e}")
+        with self._lock:
+            if vec is None:
+                self.misses += 1
+                return None
+            vec.setflags(write=False)
+            self._remember(key, vec)
+            self.disk_hits += 1
+        return vec
+
+    def put(self, text: str, vec: np.ndarray) -> None:
+        key = normalize_query(text)
+        vec = np.asarray(vec, dtype=np.float32)
+        vec.setflags(write=False)
+        with self._lock:
+            self._remember(key, vec)
+        store = self._disk()
+        if store is not None:
+            try:
+                store.put(key, vec)
+            except Exception as e:
+                print(f"⚠️ Could not persist query embedding: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / total) if total else 0.0,
+                "memory_entries": len(self._lru),
+            }
@@ -0,0 +1,112 @@
+import json
+import math
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Keeps ticket numbers, acronyms and mixed tokens (JIRA-1234 → "jira", "1234", "jira-1234")
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    out: List[str] = []
+    for tok in _WORD_RE.findall((text or "").lower()):
+        out.append(tok)
+        if any(c in tok for c in "-_."):
+            out.extend(p for p in re.split(r"[-_.]", tok) if p)
+    return out
+
+# On-disk layout (one directory, every array a plain .npy so it can be mmapped):
+#   vocab.json      term -> term number
+#   doc_ids.npy     int64[n_docs]  vector id per document row
+#   doc_len.npy     int32[n_docs]  tokens per document
+#   offsets.npy     int64[n_terms+1] postings slice per term
+#   post_docs.npy   int32[n_postings] document rows, ascending within a term
+#   post_tf.npy     int32[n_postings] term frequency
+def build_index(out_dir: Path, docs: Iterable[Tuple[int, str]]) -> None:
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    vocab: Dict[str, int] = {}
+    postings: List[List[Tuple[int, int]]] = []
+    doc_ids: List[int] = []
+    doc_len: List[int] = []
+    for row, (vid, text) in enumerate(docs):
+        counts: Dict[int, int] = {}
+        toks = tokenize(text)
+        for t in toks:
+            tid = vocab.setdefault(t, len(vocab))
+            counts[tid] = counts.get(tid, 0) + 1
+        if len(postings) < len(vocab):
+            postings.extend([] for _ in range(len(vocab) - len(postings)))
+        for tid, tf in counts.items():
+            postings[tid].append((row, tf))
+        doc_ids.append(int(vid))
+        doc_len.append(len(toks))
+
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in postings]) if postings else []
+    post_docs = np.fromiter((r for p in postings for r, _ in p), dtype=np.int32, count=int(offsets[-1]))
+    post_tf = np.fromiter((tf for p in postings for _, tf in p), dtype=np.int32, count=int(offsets[-1]))
+
+    np.save(out_dir / "doc_ids.npy", np.asarray(doc_ids, dtype=np.int64))
+    np.save(out_dir / "doc_len.npy", np.asarray(doc_len, dtype=np.int32))
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "post_docs.npy", post_docs)
+    np.save(out_dir / "post_tf.npy", post_tf)
+    (out_dir / "vocab.json").write_text(json.dumps(vocab, ensure_ascii=False), encoding="utf-8")
+
+class LexicalIndex:
+    """Read side of build_index: BM25 over mmapped postings arrays."""
+    def __init__(self, index_dir: Path, mmap: bool = True):
+        d = Path(index_dir)
+        mode = "r" if mmap else None
+        self.vocab: Dict[str, int] = json.loads((d / "vocab.json").read_text(encoding="utf-8"))
+        self.doc_ids = np.load(d / "doc_ids.npy", mmap_mode=mode)
+        self.doc_len = np.load(d / "doc_len.npy", mmap_mode=mode)
+        self.offsets = np.load(d / "offsets.npy", mmap_mode=mode)
+        self.post_docs = np.load(d / "post_docs.npy", mmap_mode=mode)
+        self.post_tf = np.load(d / "post_tf.npy", mmap_mode=mode)
+        self.n_docs = len(self.doc_ids)
+        self.avg_len = float(np.mean(self.doc_len)) if self.n_docs else 0.0
+        # BM25 length normalisation per document, computed once per load
+        self._norm = BM25_K1 * (1.0 - BM25_B + BM25_B * np.asarray(self.doc_len, dtype=np.float32) / max(self.avg_len, 1e-9))
+
+    def search(self, query: str, k: int = 10, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (vector_id, bm25 score); `allowed` optionally restricts to a set of vector ids."""
+        if not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        norm = self._norm
+        hit = False
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            lo, hi = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            rows = self.post_docs[lo:hi]
+            tf = self.post_tf[lo:hi].astype(np.float32)
+            df = hi - lo
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (BM25_K1 + 1.0) / (tf + norm[rows])
+            hit = True
+        if not hit:
+            return []
+        if allowed is not None:
+            scores[~np.isin(self.doc_ids, allowed)] = 0.0
+        cand = np.flatnonzero(scores > 0)
+        if len(cand) > k:
+            cand = cand[np.argpartition(-scores[cand], k - 1)[:k]]
+        cand = cand[np.argsort(-scores[cand], kind="stable")]
+        return [(int(self.doc_ids[r]), float(scores[r])) for r in cand]
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(id) = Σ 1 / (k + rank), rank starting at 1."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, vid in enumerate(ranking, 1):
+            fused[vid] = fused.get(vid, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
@@ -0,0 +1,424 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rate_limit import is_rate_limit_error, retry_after_seconds
+
+load_dotenv()
+
+# One process-wide client for embeddings and chat (OpenAI new SDK preferred, fallback legacy).
+# Connections are pooled and kept alive across calls; every call gets a deadline.
+HTTP_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "16"))
+EMBED_TIMEOUT = float(os.getenv("OPENAI_EMBED_TIMEOUT", "20"))    # seconds per embeddings call
+CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "120"))     # seconds per chat call
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5   # seconds; attempt n sleeps uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**n))
+BACKOFF_CAP = 8.0
+BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))  # consecutive failures that open it
+BREAKER_RESET = float(os.getenv("OPENAI_BREAKER_RESET", "30"))    # seconds before a trial call
+EMBED_HEDGE_AFTER = float(os.getenv("OPENAI_EMBED_HEDGE_AFTER", "0"))  # seconds; 0 disables hedging
+# Threads for hedged attempts: each hedged caller can hold two, so keep this at least
+# twice the concurrent query embeddings (semantic_search.QUERY_EMBED_WORKERS)
+HEDGE_WORKERS = int(os.getenv("OPENAI_HEDGE_WORKERS", "64"))
+
+try:
+    from openai import OpenAI
+    try:
+        import httpx  # type: ignore
+        _http = httpx.Client(
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+        )
+    except Exception:
+        _http = None  # the SDK's own pooled client
+    _client = OpenAI(max_retries=0, http_client=_http) if _http is not None else OpenAI(max_retries=0)
+    _use_client = True
+except Exception:
+    _client = None
+    _use_client = False
+    try:
+        import openai  # type: ignore
+        import requests
+        from requests.adapters import HTTPAdapter
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+        openai.requestssession = _session
+    except Exception:
+        pass
+
+T = TypeVar("T")
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the endpoint's breaker is open."""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker: after `failures` transient errors in a row the endpoint is
+    skipped for `reset_after` seconds, then one trial call decides whether to close it again.
+    """
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        """Raise CircuitOpenError while open; True when this call is the half-open trial (see settle)."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at >= self.reset_after and not self._trial:
+                self._trial = True  # let exactly one call probe the endpoint
+                return True
+            raise CircuitOpenError(f"{self.name} circuit open after {self._count} consecutive failures")
+
+    def settle(self, trial: bool, error: Optional[BaseException] = None) -> None:
+        """
+        End the trial started by allow(), whatever happened to it: an error that is not
+        transient still means the endpoint answered, so the breaker closes; a deadline or
+        cancellation just frees the slot for the next caller to probe.
+        """
+        if not trial:
+            return
+        if error is not None and isinstance(error, Exception) and not is_transient(error):
+            self.record_success()
+            return
+        with self._lock:
+            self._trial = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+class _Unguarded(CircuitBreaker):
+    """For callers that own their retries and throttling (bulk jobs): never opens and counts nothing."""
+    def allow(self) -> bool:
+        return False
+
+    def settle(self, trial: bool, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def record_success(self) -> None:
+        pass
+
+    def record_failure(self) -> None:
+        pass
+
+_breakers: Dict[str, CircuitBreaker] = {
+    "embeddings": CircuitBreaker("embeddings"),
+    "chat": CircuitBreaker("chat"),
+}
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+def breaker_states() -> Dict[str, str]:
+    return {name: b.state for name, b in _breakers.items()}
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = {
+    "APITimeoutError", "APIConnectionError", "InternalServerError", "RateLimitError",   # openai>=1
+    "Timeout", "TryAgain", "ServiceUnavailableError",                                   # openai 0.x
+    "TimeoutError",                                                     # asyncio.TimeoutError before 3.11
+}
+
+def is_transient(exc: BaseException) -> bool:
+    """Worth retrying (and counted by the breaker): throttling, timeouts, 5xx, dropped connections."""
+    if is_rate_limit_error(exc) or isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status in _RETRYABLE_STATUS:
+        return True
+    return type(exc).__name__ in _RETRYABLE_NAMES
+
+def _retry_pause(e: Exception, breaker: CircuitBreaker, attempt: int, retries: int, stop: float) -> Optional[float]:
+    """Seconds to wait before retrying after `e`, or None when the error should propagate."""
+    if not is_transient(e):
+        return None
+    if not is_rate_limit_error(e):  # throttling means busy, not down
+        breaker.record_failure()
+    if attempt >= retries:
+        return None
+    pause = retry_after_seconds(e)
+    if pause is None:
+        pause = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if time.monotonic() + pause >= stop:
+        return None
+    return pause
+
+def call(
+    endpoint: str,
+    fn: Callable[[float], T],
+    timeout: float,
+    retries: int = MAX_RETRIES,
+    deadline: Optional[float] = None,
+    guarded: bool = True,
+) -> T:
+    """
+    Run fn(per_attempt_timeout) through the endpoint's breaker with retries.
+    - transient errors are retried with full-jitter exponential backoff, or after the
+      server's Retry-After when it sends one
+    - `deadline` (seconds from now) bounds the whole call, retries and sleeps included
+    - other errors propagate immediately; only timeouts/5xx/connection errors count
+      against the breaker
+    - guarded=False bypasses the breaker: a bulk job's failures neither open it (taking
+      interactive callers offline) nor get refused by it
+    """
+    breaker = _breakers[endpoint] if guarded else _Unguarded(endpoint)
+    stop = time.monotonic() + (deadline if deadline is not None else timeout * (retries + 1))
+    attempt = 0
+    while True:
+        trial = breaker.allow()
+        remaining = stop - time.monotonic()
+        if remaining <= 0:
+            breaker.settle(trial)
+            raise TimeoutError(f"{endpoint} call exceeded its deadline")
+        error: Optional[BaseException] = None
+        try:
+            result = fn(min(timeout, remaining))
+        except BaseException as e:
+            error = e
+            pause = _retry_pause(e, breaker, attempt, retries, stop) if isinstance(e, Exception) else None
+            if pause is None:
+                raise
+        finally:
+            breaker.settle(trial, error)
+        if error is not None:
+            time.sleep(pause)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+def _hedged(fn: Callable[[], T], hedge_after: float, timeout: float) -> T:
+    """
+    Start fn; if it hasn't finished after `hedge_after` seconds start a second copy and take
+    the first success. Waiting (queue time in the pool included) is bounded by `timeout`;
+    copies that have not started by then are cancelled.
+    """
+    stop = time.monotonic() + timeout
+    futures = [_hedge_pool.submit(fn)]
+    error: Optional[BaseException] = None
+    try:
+        done, _ = wait(futures, timeout=min(hedge_after, timeout))
+        if not done:
+            futures.append(_hedge_pool.submit(fn))
+        while futures:
+            done, rest = wait(futures, timeout=max(0.0, stop - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"hedged call did not finish within {timeout:.1f}s")
+            for fut in done:
+                if fut.exception() is None:
+                    return fut.result()
+                error = fut.exception()
+            futures = list(rest)
+    finally:
+        for fut in futures:
+            fut.cancel()
+    raise error  # type: ignore[misc]
+
+# ─────────────────────────────────────────────────────────────
+# Endpoints
+# ─────────────────────────────────────────────────────────────
+def _embed_once(model: str, texts: List[str], timeout: float) -> List[np.ndarray]:
+    if _use_client:
+        resp = _client.embeddings.create(model=model, input=texts, timeout=timeout)  # type: ignore
+        return [np.asarray(d.embedding, dtype=np.float32) for d in sorted(resp.data, key=lambda d: d.index)]
+    resp = openai.Embedding.create(model=model, input=texts, request_timeout=timeout)  # type: ignore
+    return [np.asarray(d["embedding"], dtype=np.float32) for d in sorted(resp["data"], key=lambda d: d["index"])]
+
+def embed(
+    model: str,
+    texts: List[str],
+    timeout: float = EMBED_TIMEOUT,
+    retries: int = MAX_RETRIES,
+    deadline: Optional[float] = None,
+    hedge: bool = False,
+    guarded: bool = True,
+) -> List[np.ndarray]:
+    """
+    Embeddings for `texts`, in input order. hedge=True duplicates slow attempts
+    (EMBED_HEDGE_AFTER); guarded=False keeps a bulk job out of the shared breaker.
+    """
+    def attempt(t: float) -> List[np.ndarray]:
+        if hedge and EMBED_HEDGE_AFTER > 0:
+            return _hedged(lambda: _embed_once(model, texts, t), EMBED_HEDGE_AFTER, t)
+        return _embed_once(model, texts, t)
+    return call("embeddings", attempt, timeout, retries=retries, deadline=deadline, guarded=guarded)
+
+def chat(model: str, messages: List[Dict], timeout: float = CHAT_TIMEOUT, retries: int = MAX_RETRIES) -> str:
+    def attempt(t: float) -> str:
+        if _use_client:
+            resp = _client.chat.completions.create(model=model, messages=messages, timeout=t)  # type: ignore
+            return resp.choices[0].message.content
+        resp = openai.ChatCompletion.create(model=model, messages=messages, request_timeout=t)  # type: ignore
+        return resp.choices[0].message["content"]
+    return call("chat", attempt, timeout, retries=retries)
+
+def chat_stream(model: str, messages: List[Dict], timeout: float = CHAT_TIMEOUT, retries: int = MAX_RETRIES) -> Iterator[str]:
+    """
+    Completion text as it arrives. Opening the stream is retried like chat(); once
+    tokens have been yielded a failure propagates (the caller has already shown them).
+    """
+    def attempt(t: float):
+        if _use_client:
+            stream = _client.chat.completions.create(  # type: ignore
+                model=model, messages=messages, stream=True, timeout=t,
+            )
+            return iter(stream)
+        stream = openai.ChatCompletion.create(  # type: ignore
+            model=model, messages=messages, stream=True, request_timeout=t,
+        )
+        return iter(stream)
+
+    def first_piece(t: float):
+        it = attempt(t)
+        return it, next(it, None)  # the first chunk is where connection errors surface
+
+    breaker = _breakers["chat"]
+    it, chunk = call("chat", first_piece, timeout, retries=retries)
+    while chunk is not None:
+        if _use_client:
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+        else:
+            piece = chunk["choices"][0].get("delta", {}).get("content")
+        if piece:
+            yield piece
+        try:
+            chunk = next(it, None)
+        except Exception as e:
+            if is_transient(e) and not is_rate_limit_error(e):
+                breaker.record_failure()
+            raise
+
+# ─────────────────────────────────────────────────────────────
+# Async endpoints (same breakers, backoff and deadlines)
+# ─────────────────────────────────────────────────────────────
+# httpx async pools belong to the event loop that created them, so keep one client per loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+
+def _async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        try:
+            import httpx  # type: ignore
+            http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            )
+            client = AsyncOpenAI(max_retries=0, http_client=http)
+        except ImportError:
+            client = AsyncOpenAI(max_retries=0)
+        _async_clients[loop] = client
+    return client
+
+async def acall(
+    endpoint: str,
+    fn: Callable[[float], Awaitable[T]],
+    timeout: float,
+    retries: int = MAX_RETRIES,
+    deadline: Optional[float] = None,
+    guarded: bool = True,
+) -> T:
+    """call() for coroutines. Attempts are also bounded by asyncio.wait_for, and cancelling the caller cancels the request."""
+    breaker = _breakers[endpoint] if guarded else _Unguarded(endpoint)
+    stop = time.monotonic() + (deadline if deadline is not None else timeout * (retries + 1))
+    attempt = 0
+    while True:
+        trial = breaker.allow()
+        remaining = stop - time.monotonic()
+        if remaining <= 0:
+            breaker.settle(trial)
+            raise TimeoutError(f"{endpoint} call exceeded its deadline")
+        error: Optional[BaseException] = None
+        try:
+            t = min(timeout, remaining)
+            result = await asyncio.wait_for(fn(t), t)
+        except BaseException as e:  # CancelledError included: the trial slot must be freed
+            error = e
+            pause = _retry_pause(e, breaker, attempt, retries, stop) if isinstance(e, Exception) else None
+            if pause is None:
+                raise
+        finally:
+            breaker.settle(trial, error)
+        if error is not None:
+            await asyncio.sleep(pause)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+async def _ahedged(make: Callable[[], Awaitable[T]], hedge_after: float) -> T:
+    first = asyncio.ensure_future(make())
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return first.result()
+    pending = {first, asyncio.ensure_future(make())}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    return fut.result()
+                error = fut.exception()
+    finally:
+        for fut in pending:
+            fut.cancel()
+    raise error  # type: ignore[misc]
+
+async def _aembed_once(model: str, texts: List[str], timeout: float) -> List[np.ndarray]:
+    if _use_client:
+        resp = await _async_client().embeddings.create(model=model, input=texts, timeout=timeout)
+        return [np.asarray(d.embedding, dtype=np.float32) for d in sorted(resp.data, key=lambda d: d.index)]
+    resp = await openai.Embedding.acreate(model=model, input=texts, request_timeout=timeout)  # type: ignore
+    return [np.asarray(d["embedding"], dtype=np.float32) for d in sorted(resp["data"], key=lambda d: d["index"])]
+
+async def aembed(
+    model: str,
+    texts: List[str],
+    timeout: float = EMBED_TIMEOUT,
+    retries: int = MAX_RETRIES,
+    deadline: Optional[float] = None,
+    hedge: bool = False,
+) -> List[np.ndarray]:
+    async def attempt(t: float) -> List[np.ndarray]:
+        if hedge and EMBED_HEDGE_AFTER > 0:
+            return await _ahedged(lambda: _aembed_once(model, texts, t), EMBED_HEDGE_AFTER)
+        return await _aembed_once(model, texts, t)
+    return await acall("embeddings", attempt, timeout, retries=retries, deadline=deadline)
+
+async def achat(model: str, messages: List[Dict], timeout: float = CHAT_TIMEOUT, retries: int = MAX_RETRIES) -> str:
+    async def attempt(t: float) -> str:
+        if _use_client:
+            resp = await _async_client().chat.completions.create(model=model, messages=messages, timeout=t)
+            return resp.choices[0].message.content
+        resp = await openai.ChatCompletion.acreate(model=model, messages=messages, request_timeout=t)  # type: ignore
+        return resp.choices[0].message["content"]
+    return await acall("chat", attempt, timeout, retries=retries)
@@ -0,0 +1,296 @@
+import json
+import mmap
+from collections.abc import Mapping
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# ─────────────────────────────────────────────────────────────
+# Typed columns: what filters and rerank read instead of dict fields
+# ─────────────────────────────────────────────────────────────
+def day_ordinal(s: Optional[str]) -> int:
+    """date.toordinal() of an ISO date/datetime string; 0 when missing or unparseable."""
+    if not s:
+        return 0
+    s = str(s).strip().replace("Z", "")
+    for parse in (datetime.fromisoformat, lambda v: datetime.strptime(v[:10], "%Y-%m-%d")):
+        try:
+            return parse(s).toordinal()
+        except Exception:
+            pass
+    return 0
+
+class MetaColumns(NamedTuple):
+    ids: np.ndarray             # int64 vector ids, sorted (positions found by searchsorted)
+    folder_code: np.ndarray     # int32 index into folder_names
+    folder_names: Tuple[str, ...]  # lower-cased folder labels
+    meeting_ord: np.ndarray     # date.toordinal() of meeting_date, 0 = none
+    valid_from_ord: np.ndarray  # same for valid_from / valid_to
+    valid_to_ord: np.ndarray
+    tag_bits: np.ndarray        # (n, words) uint64 bitset over tag_vocab
+    tag_vocab: Dict[str, int]   # tag -> bit number
+
+    def folder_codes(self, names: List[str]) -> List[int]:
+        lookup = {n: i for i, n in enumerate(self.folder_names)}
+        return [lookup[n.lower()] for n in names if n.lower() in lookup]
+
+    def positions(self, rids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions for ids, plus a mask of which ids exist in the columns."""
+        if len(self.ids) == 0:
+            return np.zeros(len(rids), dtype=np.int64), np.zeros(len(rids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.ids, rids), len(self.ids) - 1)
+        return pos, self.ids[pos] == rids
+
+    def tag_mask(self, tags) -> np.ndarray:
+        mask = np.zeros(self.tag_bits.shape[1], dtype=np.uint64)
+        for t in tags:
+            bit = self.tag_vocab.get(t)
+            if bit is not None:
+                mask[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return mask
+
+def _row_tags(meta: Dict) -> set:
+    return {t.strip().lower() for t in (meta.get("tags") or []) if t}
+
+def build_columns(metadata: Mapping[int, Dict]) -> MetaColumns:
+    ids = np.sort(np.fromiter((int(i) for i in metadata), dtype=np.int64, count=len(metadata)))
+    metas = [metadata[int(i)] for i in ids]
+
+    folder_names: Dict[str, int] = {}
+    folder_code = np.array(
+        [folder_names.setdefault(str(m.get("folder", "")).lower(), len(folder_names)) for m in metas],
+        dtype=np.int32,
+    )
+    row_tags = [_row_tags(m) for m in metas]
+    tag_vocab: Dict[str, int] = {}
+    for tags in row_tags:
+        for t in sorted(tags):
+            tag_vocab.setdefault(t, len(tag_vocab))
+    tag_bits = np.zeros((len(metas), max(1, -(-len(tag_vocab) // 64))), dtype=np.uint64)
+    for r, tags in enumerate(row_tags):
+        for t in tags:
+            bit = tag_vocab[t]
+            tag_bits[r, bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+
+    return MetaColumns(
+        ids=ids,
+        folder_code=folder_code,
+        folder_names=tuple(folder_names),
+        meeting_ord=np.array([day_ordinal(m.get("meeting_date")) for m in metas], dtype=np.int32),
+        valid_from_ord=np.array([day_ordinal(m.get("valid_from")) for m in metas], dtype=np.int32),
+        valid_to_ord=np.array([day_ordinal(m.get("valid_to")) for m in metas], dtype=np.int32),
+        tag_bits=tag_bits,
+        tag_vocab=tag_vocab,
+    )
+
+# ─────────────────────────────────────────────────────────────
+# Columnar store (metadata.col): every field as a typed column, one file, mmap'd
+# ─────────────────────────────────────────────────────────────
+# Layout (little-endian):
+#   magic[8] | header_len: uint64 | header: JSON {name: [dtype, shape, offset]} | arrays, 64-byte aligned
+# Repeated strings (filename, path, folder, title, dates, a file's tag list) are stored
+# once in a string table (utf-8 bytes + offsets) and rows hold an int32 code, -1 = None.
+# The filter columns above (MetaColumns) are stored alongside, so opening the store
+# parses only the header; rows are decoded into dicts when a hit asks for them.
+_COL_MAGIC = b"BRCOLS01"
+_ALIGN = 64
+_INT_FIELDS = ("chunk_id", "char_start", "char_end", "tokens")
+_STR_FIELDS = ("filename", "path", "folder", "title", "meeting_date", "valid_from", "valid_to")
+
+def _intern(values, strings: Optional[List[str]] = None) -> Tuple[np.ndarray, List[str]]:
+    """Codes for `values` in a string table, extending `strings` (a copy) with unseen values."""
+    table: Dict[str, int] = {v: i for i, v in enumerate(strings or [])}
+    codes = np.array([-1 if v is None else table.setdefault(str(v), len(table)) for v in values], dtype=np.int32)
+    return codes, list(table)
+
+def _compact(codes: np.ndarray, strings: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """Drop strings no row refers to any more and renumber the codes to match."""
+    used = np.unique(codes[codes >= 0])
+    if len(used) == len(strings):
+        return codes, strings
+    remap = np.full(len(strings) + 1, -1, dtype=np.int32)
+    remap[used] = np.arange(len(used), dtype=np.int32)
+    return remap[codes], [strings[i] for i in used]
+
+def _string_table(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    blobs = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype="<i8")
+    if blobs:
+        offsets[1:] = np.cumsum([len(b) for b in blobs])
+    return offsets, np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+def _tag_bits(base_bits: np.ndarray, vocab: Dict[str, int], metas: List[Dict]) -> np.ndarray:
+    """`base_bits` widened to the (already extended) vocab, with one new row per meta."""
+    words = max(1, -(-len(vocab) // 64))
+    bits = np.zeros((len(base_bits) + len(metas), words), dtype=np.uint64)
+    bits[:len(base_bits), :base_bits.shape[1]] = base_bits
+    for r, m in enumerate(metas, start=len(base_bits)):
+        for t in _row_tags(m):
+            bit = vocab[t]
+            bits[r, bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+    return bits
+
+def write_store(
+    path: Path,
+    rows: Mapping[int, Dict],
+    base: Optional["ColumnarMetadata"] = None,
+    drop: Iterable[int] = (),
+) -> None:
+    """
+    Write metadata.col holding `base` minus the `drop` ids plus `rows` ({vector_id: meta}).
+    Rows kept from `base` are carried over column by column with an id mask and never
+    decoded, so a refresh costs the size of the change plus a copy of the arrays.
+    """
+    new_ids = np.sort(np.fromiter((int(i) for i in rows), dtype=np.int64, count=len(rows)))
+    metas = [rows[int(i)] for i in new_ids]
+    if base is not None:
+        gone = np.concatenate((np.fromiter((int(i) for i in drop), dtype=np.int64), new_ids))
+        keep = ~np.isin(base.ids, gone)
+        carried = lambda name: base.column(name)[keep]
+        strings = base.strings
+    else:
+        keep = np.zeros(0, dtype=bool)
+        carried = lambda name: np.zeros((0,) + ((1,) if name == "filter.tag_bits" else ()), dtype=np.int64)
+        strings = lambda name: []
+
+    arrays: Dict[str, np.ndarray] = {"ids": np.concatenate((carried("ids"), new_ids))}
+    tables: Dict[str, List[str]] = {}
+    for field in _INT_FIELDS:
+        arrays[field] = np.concatenate((carried(field), [int(m.get(field) or 0) for m in metas])).astype(np.int64)
+    fields = {field: [m.get(field) for m in metas] for field in _STR_FIELDS}
+    fields["tags"] = [json.dumps(list(m.get("tags") or []), ensure_ascii=False) for m in metas]
+    fields["filter.folder_names"] = [str(m.get("folder", "")).lower() for m in metas]
+    for field, values in fields.items():
+        col = "filter.folder_code" if field == "filter.folder_names" else field
+        codes, table = _intern(values, strings(field))
+        arrays[col], tables[field] = _compact(np.concatenate((carried(col), codes)).astype(np.int32), table)
+
+    ordinals: Dict[Optional[str], int] = {}  # a file's chunks share their dates
+    for field, col in (("meeting_date", "filter.meeting_ord"), ("valid_from", "filter.valid_from_ord"), ("valid_to", "filter.valid_to_ord")):
+        new = np.zeros(len(metas), dtype=np.int32)
+        for r, m in enumerate(metas):
+            d = m.get(field)
+            if d not in ordinals:
+                ordinals[d] = day_ordinal(d)
+            new[r] = ordinals[d]
+        arrays[col] = np.concatenate((carried(col), new)).astype(np.int32)
+    # Tags no longer used keep their bit until a full rebuild; they match no rows
+    tag_names = strings("filter.tag_names")
+    vocab = {t: i for i, t in enumerate(tag_names)}
+    for m in metas:
+        for t in sorted(_row_tags(m)):
+            vocab.setdefault(t, len(vocab))
+    arrays["filter.tag_bits"] = _tag_bits(carried("filter.tag_bits").astype(np.uint64), vocab, metas)
+    tables["filter.tag_names"] = list(vocab)
+
+    order = np.argsort(arrays["ids"], kind="stable")
+    for name in arrays:
+        arrays[name] = arrays[name][order]
+    for name, table in tables.items():
+        arrays[f"{name}.offsets"], arrays[f"{name}.utf8"] = _string_table(table)
+
+    header: Dict[str, list] = {}
+    at = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arrays[name] = arr
+        header[name] = [arr.dtype.newbyteorder("<").str, list(arr.shape), at]
+        at += -(-arr.nbytes // _ALIGN) * _ALIGN
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    base_at = -(-(16 + len(head)) // _ALIGN) * _ALIGN
+    with open(path, "wb") as f:
+        f.write(_COL_MAGIC)
+        f.write(np.uint64(len(head)).astype("<u8").tobytes())
+        f.write(head)
+        for name, arr in arrays.items():
+            f.write(b"\0" * (base_at + header[name][2] - f.tell()))
+            f.write(arr.astype(header[name][0], copy=False).tobytes())
+        f.write(b"\0" * (base_at + at - f.tell()))
+
+class ColumnarMetadata(Mapping):
+    """
+    Read-only {vector_id: meta dict} view over metadata.col. Columns are numpy views
+    of the mmap, so open is O(1) and every process on a host shares the pages; a row's
+    dict is assembled (and its interned strings decoded) only when it is looked up.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != _COL_MAGIC:
+            raise ValueError(f"{self.path} is not a columnar metadata store")
+        head_len = int.from_bytes(self._mm[8:16], "little")
+        header = json.loads(self._mm[16:16 + head_len])
+        base = -(-(16 + head_len) // _ALIGN) * _ALIGN
+        self._cols: Dict[str, np.ndarray] = {}
+        for name, (dtype, shape, offset) in header.items():
+            count = int(np.prod(shape))
+            self._cols[name] = np.frombuffer(self._mm, dtype=dtype, count=count, offset=base + offset).reshape(shape)
+        self._ids = self._cols["ids"]
+
+    def _string(self, field: str, code: int) -> Optional[str]:
+        if code < 0:
+            return None
+        offsets = self._cols[f"{field}.offsets"]
+        start = int(offsets[code])
+        return bytes(self._cols[f"{field}.utf8"][start:int(offsets[code + 1])]).decode("utf-8")
+
+    def strings(self, field: str) -> List[str]:
+        """String table of an interned field, indexed by the codes in column(field)."""
+        return [self._string(field, c) for c in range(len(self._cols[f"{field}.offsets"]) - 1)]
+
+    def values(self, field: str) -> List[Optional[str]]:
+        """Per-row values of an interned string field; each distinct string is decoded once."""
+        table = self.strings(field)
+        return [table[c] if c >= 0 else None for c in self._cols[field].tolist()]
+
+    def _pos(self, vid: int) -> Optional[int]:
+        i = int(np.searchsorted(self._ids, vid))
+        if i < len(self._ids) and int(self._ids[i]) == vid:
+            return i
+        return None
+
+    def __getitem__(self, vid: int) -> Dict:
+        i = self._pos(int(vid))
+        if i is None:
+            raise KeyError(vid)
+        meta: Dict = {field: self._string(field, int(self._cols[field][i])) for field in _STR_FIELDS}
+        for field in _INT_FIELDS:
+            meta[field] = int(self._cols[field][i])
+        meta["tags"] = json.loads(self._string("tags", int(self._cols["tags"][i])))
+        return meta
+
+    def __contains__(self, vid) -> bool:
+        try:
+            return self._pos(int(vid)) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(i) for i in self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids
+
+    def column(self, field: str) -> np.ndarray:
+        """Raw column: int64 values for numeric fields, int32 codes for interned strings."""
+        return self._cols[field]
+
+    @property
+    def columns(self) -> MetaColumns:
+        return MetaColumns(
+            ids=self._ids,
+            folder_code=self._cols["filter.folder_code"],
+            folder_names=tuple(self.strings("filter.folder_names")),
+            meeting_ord=self._cols["filter.meeting_ord"],
+            valid_from_ord=self._cols["filter.valid_from_ord"],
+            valid_to_ord=self._cols["filter.valid_to_ord"],
+            tag_bits=self._cols["filter.tag_bits"],
+            tag_vocab={t: i for i, t in enumerate(self.strings("filter.tag_names"))},
+        )
@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Optional
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` units/minute.
+    `capacity` caps the burst (defaults to one minute's worth).
+    """
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.per_minute = float(per_minute)
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.per_minute / 60.0)
+        self._stamp = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units now and return how long the caller must wait before using them."""
+        amount = min(float(amount), self.capacity)  # an oversize request waits for a full bucket, not forever
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens * 60.0 / self.per_minute
+
+    def set_rate(self, per_minute: float) -> None:
+        """Change the refill rate; the burst cap scales with it, so a full bucket can't burst at the old rate."""
+        with self._lock:
+            self._refill(time.monotonic())
+            new_rate = max(1.0, float(per_minute))
+            self.capacity *= new_rate / self.per_minute
+            self._tokens = min(self._tokens, self.capacity)
+            self.per_minute = new_rate
+
+class RateLimiter:
+    """
+    Shared requests-per-minute + tokens-per-minute limiter for concurrent workers.
+    - acquire(tokens) blocks until both buckets allow the call and no cooldown is active
+    - on_rate_limit(retry_after) pauses every worker and cuts the rate (multiplicative decrease)
+    - on_success() creeps the rate back up towards the configured ceiling (additive increase)
+    """
+    def __init__(self, rpm: float, tpm: float, min_fraction: float = 0.1):
+        self.max_rpm, self.max_tpm = float(rpm), float(tpm)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._fraction = 1.0
+        self._min_fraction = min_fraction
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0) -> None:
+        while True:
+            with self._lock:
+                pause = self._cooldown_until - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if wait > 0:
+            time.sleep(wait)
+
+    def _apply_fraction(self) -> None:
+        self.requests.set_rate(self.max_rpm * self._fraction)
+        self.tokens.set_rate(self.max_tpm * self._fraction)
+
+    def on_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self._fraction = max(self._min_fraction, self._fraction * 0.5)
+            pause = retry_after if retry_after is not None else 60.0 / max(1.0, self.max_rpm * self._fraction)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + pause)
+            self._apply_fraction()
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self._fraction < 1.0:
+                self._fraction = min(1.0, self._fraction + 0.05)
+                self._apply_fraction()
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status == 429:
+        return True
+    return type(exc).__name__ == "RateLimitError"
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Read Retry-After / retry-after-ms from an SDK exception (new or legacy), if present."""
+    headers = None
+    resp = getattr(exc, "response", None)
+    if resp is not None:
+        headers = getattr(resp, "headers", None)
+    if headers is None:
+        headers = getattr(exc, "headers", None)  # legacy openai.error.* exceptions
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms is not None:
+            return float(ms) / 1000.0
+        ra = headers.get("retry-after")
+        if ra is not None:
+            return float(ra)
+    except (TypeError, ValueError):
+        pass
+    return None
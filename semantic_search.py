@@ -1,75 +1,465 @@
-import pickle
+import asyncio
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, NamedTuple, Mapping
 from datetime import datetime
 import os
+import pickle
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import faiss
 from dotenv import load_dotenv
 
-load_dotenv()
+import llm_client
+from meta_store import ColumnarMetadata, MetaColumns, build_columns
+from text_store import ChunkTexts
+from embedding_cache import QueryEmbeddingCache
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
 
-# Embedding for query (OpenAI new SDK preferred, fallback to legacy)
-try:
-    from openai import OpenAI
-    _client = OpenAI()
-    _use_client = True
-except Exception:
-    _client = None
-    _use_client = False
-    try:
-        import openai  # type: ignore
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-    except Exception:
-        pass
+load_dotenv()
 
 EMBED_MODEL = "text-embedding-3-small"
 EMBED_DIM = 1536
 
 INDEX_PATH = Path("embeddings/faiss.index")
-META_PATH = Path("embeddings/metadata.pkl")
+META_PATH = Path("embeddings/metadata.col")
+LEGACY_META_PATH = Path("embeddings/metadata.pkl")  # pickled dict written by builds before metadata.col
+TEXT_BLOB_PATH = Path("embeddings/chunks.bin")
+TEXT_TABLE_PATH = Path("embeddings/chunks.idx")
+GENERATION_PATH = Path("embeddings/GENERATION")
+LEXICAL_PREFIX = "lexical-"   # embeddings/lexical-<generation>/ written by embed_and_store
+RELOAD_CHECK_INTERVAL = 1.0  # seconds between generation-marker checks
+QUERY_CACHE_PATH = Path("embeddings/query_cache.sqlite")
+CANDIDATE_POOL = 200          # neighbours fetched per query before filtering/reranking
+QUERY_BATCH_MAX_ITEMS = 2048  # embeddings endpoint input limit
 
 _TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
 
-def _embed_query_client(text: str) -> np.ndarray:
-    resp = _client.embeddings.create(model=EMBED_MODEL, input=text)
-    return np.asarray(resp.data[0].embedding, dtype=np.float32)
+_query_cache = QueryEmbeddingCache(
+    QUERY_CACHE_PATH, EMBED_MODEL, EMBED_DIM,
+    max_memory=int(os.getenv("QUERY_CACHE_MEMORY_ENTRIES", "2048")),
+    max_disk=int(os.getenv("QUERY_CACHE_DISK_ENTRIES", "50000")),
+)
 
-def _embed_query_legacy(text: str) -> np.ndarray:
-    resp = openai.Embedding.create(model=EMBED_MODEL, input=text)  # type: ignore
-    return np.asarray(resp["data"][0]["embedding"], dtype=np.float32)
+def query_cache_stats() -> Dict[str, float]:
+    return _query_cache.stats()
 
 def embed_query(text: str) -> np.ndarray:
-    arr = _embed_query_client(text) if _use_client else _embed_query_legacy(text)
+    cached = _query_cache.get(text)
+    if cached is not None:
+        return cached
+    # whole call, retries included, fits the retrieval latency budget; slow attempts may be hedged
+    arr = llm_client.embed(EMBED_MODEL, [text], deadline=EMBED_QUERY_TIMEOUT, hedge=True)[0]
     if arr.shape != (EMBED_DIM,):
         # allow legacy clients to return lists
         arr = np.asarray(arr, dtype=np.float32).reshape(-1)
     if arr.shape != (EMBED_DIM,):
         raise ValueError(f"Unexpected embedding shape {arr.shape}")
+    _query_cache.put(text, arr)
     return arr
 
-def load_resources():
-    if not INDEX_PATH.exists() or not META_PATH.exists():
-        raise FileNotFoundError("Missing FAISS index or metadata. Run embed_and_store.py first.")
-    index = faiss.read_index(str(INDEX_PATH))
-    with open(META_PATH, "rb") as f:
+async def embed_query_async(text: str) -> np.ndarray:
+    """embed_query() on the async client; the cache lookups stay synchronous (local SQLite)."""
+    cached = _query_cache.get(text)
+    if cached is not None:
+        return cached
+    vecs = await llm_client.aembed(EMBED_MODEL, [text], deadline=EMBED_QUERY_TIMEOUT, hedge=True)
+    arr = np.asarray(vecs[0], dtype=np.float32).reshape(-1)
+    if arr.shape != (EMBED_DIM,):
+        raise ValueError(f"Unexpected embedding shape {arr.shape}")
+    _query_cache.put(text, arr)
+    return arr
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    """Embed many queries as an (n, EMBED_DIM) matrix; cache misses go out in one request per 2048."""
+    out = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    missing: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        cached = _query_cache.get(text)
+        if cached is not None:
+            out[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+
+    uniq = list(missing)
+    for b in range(0, len(uniq), QUERY_BATCH_MAX_ITEMS):
+        part = uniq[b:b + QUERY_BATCH_MAX_ITEMS]
+        vecs = llm_client.embed(EMBED_MODEL, part)
+        if len(vecs) != len(part):
+            raise ValueError(f"Expected {len(part)} embeddings, got {len(vecs)}")
+        for text, arr in zip(part, vecs):
+            if arr.shape != (EMBED_DIM,):
+                raise ValueError(f"Unexpected embedding shape {arr.shape}")
+            _query_cache.put(text, arr)
+            out[missing[text]] = arr
+    return out
+
+class IndexSnapshot(NamedTuple):
+    index: "faiss.Index"
+    metadata: Mapping[int, Dict]  # ColumnarMetadata, or the unpickled dict of a legacy build
+    columns: MetaColumns          # typed filter/rerank fields, parsed at index time
+    lexical: Optional[LexicalIndex]  # BM25 postings for hybrid search (None on older builds)
+    texts: Optional[ChunkTexts]   # full chunk texts, mmap'd (None on builds with text_preview)
+    generation: str
+
+def _read_generation() -> str:
+    """Generation marker written last by embed_and_store; falls back to file mtimes for older builds."""
+    try:
+        return GENERATION_PATH.read_text(encoding="utf-8").strip()
+    except OSError:
+        stamps = [str(p.stat().st_mtime_ns) for p in (INDEX_PATH, META_PATH, LEGACY_META_PATH) if p.exists()]
+        return "mtime:" + ":".join(stamps)
+
+# Map the vectors instead of copying them to the heap: IO_FLAG_MMAP_IFC covers flat
+# indexes on faiss >= 1.9, IO_FLAG_MMAP the IVF lists on older builds.
+_MMAP_FLAGS = [getattr(faiss, name) for name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP") if hasattr(faiss, name)]
+
+def _read_index() -> "faiss.Index":
+    for flag in _MMAP_FLAGS:
+        try:
+            return faiss.read_index(str(INDEX_PATH), flag)
+        except Exception:
+            continue
+    return faiss.read_index(str(INDEX_PATH))
+
+def _read_metadata() -> Tuple[Mapping[int, Dict], MetaColumns]:
+    if META_PATH.exists():
+        metadata = ColumnarMetadata(META_PATH)
+        return metadata, metadata.columns
+    # Legacy builds keep working until the next refresh writes metadata.col
+    with open(LEGACY_META_PATH, "rb") as f:
         metadata = pickle.load(f)
-    return index, metadata
+    return metadata, build_columns(metadata)
 
-def search(query: str, k: int = 5) -> List[Tuple[int, float, Dict]]:
-    index, metadata = load_resources()
-    qvec = embed_query(query).reshape(1, -1)
-    # L2 index by default
-    D, I = index.search(qvec, max(k, 200))
+def _read_texts() -> Optional[ChunkTexts]:
+    """The chunk text store, or None on builds without one (they carry text_preview instead)."""
+    if not TEXT_TABLE_PATH.exists():
+        return None
+    return ChunkTexts(TEXT_BLOB_PATH, TEXT_TABLE_PATH)  # ValueError when caught mid-compaction
+
+def _load_snapshot(generation: str) -> IndexSnapshot:
+    """
+    Open the published files as one consistent set. A publish may land between the
+    reads, so a mismatch is retried; if it persists this raises, and _ResidentIndex
+    keeps serving the previous snapshot.
+    """
+    if not INDEX_PATH.exists() or not (META_PATH.exists() or LEGACY_META_PATH.exists()):
+        raise FileNotFoundError("Missing FAISS index or metadata. Run embed_and_store.py first.")
+    for attempt in range(3):
+        if attempt:
+            time.sleep(0.2)
+            generation = _read_generation()
+        try:
+            index = _read_index()
+            metadata, columns = _read_metadata()
+            texts = _read_texts()
+        except (OSError, ValueError, RuntimeError) as e:  # RuntimeError: faiss read of a partial file
+            error: Exception = e
+            continue
+        if index.ntotal == len(metadata) == len(columns.ids) and (texts is None or len(texts) == index.ntotal):
+            break
+        error = RuntimeError(
+            f"index ({index.ntotal}), metadata ({len(metadata)}) and chunk texts "
+            f"({len(texts) if texts is not None else '-'}) disagree"
+        )
+    else:
+        raise error
+    lexical_dir = GENERATION_PATH.parent / f"{LEXICAL_PREFIX}{generation}"
+    lexical = LexicalIndex(lexical_dir) if lexical_dir.is_dir() else None
+    return IndexSnapshot(index, metadata, columns, lexical, texts, generation)
+
+class _ResidentIndex:
+    """
+    Process-wide index + metadata, loaded once and shared by all threads.
+    When the generation marker changes, one thread loads the new files while the
+    others keep serving the previous snapshot; the swap is a single reference
+    assignment, so in-flight queries finish on the snapshot they started with.
+    """
+    def __init__(self):
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+
+    def get(self) -> IndexSnapshot:
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return snap
+        generation = _read_generation()
+        self._checked_at = now
+        if snap is not None and snap.generation == generation:
+            return snap
+
+        # Someone else is already loading: keep answering from the old snapshot
+        if not self._reload_lock.acquire(blocking=snap is None):
+            return snap
+        try:
+            current = self._snapshot
+            if current is not None and current.generation == generation:
+                return current
+            try:
+                self._snapshot = _load_snapshot(generation)
+            except Exception:
+                if current is None:
+                    raise
+                print("⚠️ Failed to hot-reload index; serving the previous generation.")
+                return current
+            return self._snapshot
+        finally:
+            self._reload_lock.release()
+
+    def invalidate(self) -> None:
+        self._checked_at = 0.0
+
+_resident = _ResidentIndex()
+
+def load_resources():
+    snap = _resident.get()
+    return snap.index, snap.metadata
+
+def current_generation() -> str:
+    return _resident.get().generation
+
+# ─────────────────────────────────────────────────────────────
+# Query vectors with a latency budget + offline (lexical) fallback
+# ─────────────────────────────────────────────────────────────
+EMBED_QUERY_TIMEOUT = float(os.getenv("EMBED_QUERY_TIMEOUT", "3.0"))  # seconds before going lexical
+OFFLINE_RETRY_AFTER = 30.0  # after a failure, skip the API (cache only) for this long
+
+MODE_VECTOR = "vector"
+MODE_HYBRID = "hybrid"
+MODE_LEXICAL_OFFLINE = "lexical-offline"
+
+# Shared pool for query embeddings, so hybrid search doesn't pay thread start-up per query.
+# Sized for the expected number of concurrent searches: a query waiting here for a worker
+# is only delayed, its EMBED_QUERY_TIMEOUT budget starts when the call does.
+QUERY_EMBED_WORKERS = int(os.getenv("QUERY_EMBED_WORKERS", "32"))
+_executor = ThreadPoolExecutor(max_workers=QUERY_EMBED_WORKERS, thread_name_prefix="semantic-search")
+_mode = threading.local()
+_offline_until = 0.0
+
+def last_retrieval_mode() -> str:
+    """Mode used by this thread's most recent search: vector, hybrid or lexical-offline."""
+    return getattr(_mode, "value", MODE_VECTOR)
+
+def _set_mode(mode: str) -> None:
+    _mode.value = mode
+
+def _is_budget_timeout(e: BaseException) -> bool:
+    return isinstance(e, TimeoutError) or type(e).__name__ in ("APITimeoutError", "Timeout", "TimeoutError")
+
+def _embedding_failed(e: BaseException) -> None:
+    """
+    Log a failed query embedding. Running out of EMBED_QUERY_TIMEOUT only sends this
+    query to lexical retrieval; API errors (including an open circuit breaker) also put
+    the process offline for OFFLINE_RETRY_AFTER seconds.
+    """
+    global _offline_until
+    if _is_budget_timeout(e):
+        print(f"⚠️ Query embedding exceeded {EMBED_QUERY_TIMEOUT:.1f}s; using offline lexical retrieval.")
+        return
+    print(f"⚠️ Query embedding failed ({e}); using offline lexical retrieval.")
+    _offline_until = time.monotonic() + OFFLINE_RETRY_AFTER
+
+def _await_budget(fut):
+    """
+    Result of an embedding future, or None if it fails. embed_query bounds the call
+    itself (llm_client deadline), so the budget is not charged for time in the queue.
+    """
+    global _offline_until
+    try:
+        result = fut.result()
+    except Exception as e:
+        _embedding_failed(e)
+        return None
+    _offline_until = 0.0
+    return result
+
+def _submit_query_vector(query: str):
+    """
+    Start embedding `query` on the executor and return a zero-arg callable that yields
+    the (1, EMBED_DIM) vector, or None when the embeddings API is unreachable.
+    """
+    if time.monotonic() < _offline_until:
+        cached = _query_cache.get(query)
+        return lambda: cached.reshape(1, -1) if cached is not None else None
+    fut = _executor.submit(embed_query, query)
+    def _wait() -> Optional[np.ndarray]:
+        vec = _await_budget(fut)
+        return vec.reshape(1, -1) if vec is not None else None
+    return _wait
+
+def _query_vector(query: str) -> Optional[np.ndarray]:
+    return _submit_query_vector(query)()
+
+def _lexical_hits(snap: "IndexSnapshot", query: str, n: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float, Dict]]:
+    """Network-free retrieval from the BM25 postings; pseudo-distance 1/(1+bm25) keeps 'smaller is better'."""
+    if snap.lexical is None:
+        raise RuntimeError("Embeddings API unavailable and this index has no lexical fallback; re-run embed_and_store.py.")
+    _set_mode(MODE_LEXICAL_OFFLINE)
+    return [
+        (vid, 1.0 / (1.0 + score), snap.metadata.get(vid, {}))
+        for vid, score in snap.lexical.search(query, n, allowed=allowed)
+    ]
+
+# ─────────────────────────────────────────────────────────────
+# Filter pushdown: eligible-id sets → FAISS IDSelector
+# ─────────────────────────────────────────────────────────────
+def _popcount(x: np.ndarray) -> np.ndarray:
+    """Set bits per row of a (m, words) uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=-1, dtype=np.int64)
+    return np.unpackbits(np.ascontiguousarray(x).view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int64)
+
+def _columns(snap: IndexSnapshot) -> MetaColumns:
+    return snap.columns
+
+def _first_day(dt: datetime) -> int:
+    """Smallest day ordinal whose midnight is >= dt."""
+    return dt.toordinal() + (0 if dt.time() == datetime.min.time() else 1)
+
+def eligible_ids(
+    cols: MetaColumns,
+    folders: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    valid_on: Optional[datetime] = None,
+) -> np.ndarray:
+    """
+    Ids passing every given predicate, evaluated on the metadata columns:
+      - folders: folder label in the list (case-insensitive)
+      - start/end: same rule as filter_by_date_range (meeting inside, or reminder validity overlaps)
+      - valid_on: drop reminders not valid at that moment (same rule as rerank)
+    """
+    mask = np.ones(len(cols.ids), dtype=bool)
+    if folders is not None:
+        mask &= np.isin(cols.folder_code, cols.folder_codes(folders))
+    if start is not None and end is not None:
+        lo, hi = _first_day(start), end.toordinal()
+        in_window = (cols.meeting_ord >= lo) & (cols.meeting_ord <= hi)
+        vto = np.where(cols.valid_to_ord > 0, cols.valid_to_ord, np.iinfo(np.int32).max)
+        overlaps = (cols.valid_from_ord > 0) & (cols.valid_from_ord <= hi) & (vto >= lo)
+        mask &= in_window | overlaps
+    if valid_on is not None:
+        reminders = np.isin(cols.folder_code, cols.folder_codes(["reminders"]))
+        mask &= ~reminders | _valid_at(cols.valid_from_ord, cols.valid_to_ord, valid_on)
+    return cols.ids[mask]
+
+def _valid_at(valid_from_ord: np.ndarray, valid_to_ord: np.ndarray, when: datetime) -> np.ndarray:
+    """Vectorized form of rerank's reminder check: not before valid_from and not after valid_to (midnight)."""
+    started = (valid_from_ord == 0) | (valid_from_ord <= when.toordinal())
+    not_expired = (valid_to_ord == 0) | (valid_to_ord >= _first_day(when))
+    return started & not_expired
+
+def _search_selected(snap: IndexSnapshot, qmat: np.ndarray, n: int, ids: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """index.search restricted to `ids` (None = everything); rows are padded with -1 ids."""
+    if ids is None or len(ids) == snap.index.ntotal:
+        return snap.index.search(qmat, n)
+    if len(ids) == 0:
+        return np.zeros((len(qmat), n), dtype=np.float32), np.full((len(qmat), n), -1, dtype=np.int64)
+    if not hasattr(faiss, "SearchParameters"):
+        # faiss < 1.7.3 has no selectors: rank everything, keep the first n eligible per row
+        D, I = snap.index.search(qmat, snap.index.ntotal)
+        Dn = np.zeros((len(qmat), n), dtype=np.float32)
+        In = np.full((len(qmat), n), -1, dtype=np.int64)
+        for r in range(len(qmat)):
+            keep = np.isin(I[r], ids)
+            d, i = D[r][keep][:n], I[r][keep][:n]
+            Dn[r, :len(d)], In[r, :len(i)] = d, i
+        return Dn, In
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    return snap.index.search(qmat, min(n, len(ids)), params=faiss.SearchParameters(sel=sel))
+
+def search_filtered(
+    query: str,
+    k: int = 5,
+    folders: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    valid_on: Optional[datetime] = None,
+) -> List[Tuple[int, float, Dict]]:
+    """Nearest k chunks among those passing the eligible_ids predicates; only eligible vectors are scanned."""
+    snap = _resident.get()
+    ids = eligible_ids(_columns(snap), folders=folders, start=start, end=end, valid_on=valid_on)
+    qvec = _query_vector(query)
+    if qvec is None:
+        return _lexical_hits(snap, query, k, allowed=ids)
+    _set_mode(MODE_VECTOR)
+    D, I = _search_selected(snap, qvec, k, ids)
+    return _hits(D[0], I[0], snap.metadata)
+
+def _hits(dists: np.ndarray, ids: np.ndarray, metadata: Mapping[int, Dict]) -> List[Tuple[int, float, Dict]]:
     out: List[Tuple[int, float, Dict]] = []
-    for dist, idx in zip(D[0], I[0]):
+    for dist, idx in zip(dists, ids):
         if idx == -1:
             continue
         out.append((int(idx), float(dist), metadata.get(int(idx), {})))
     return out
 
+def chunk_texts(hits: List[Tuple[int, float, Dict]]) -> List[str]:
+    """
+    Full text of each hit's chunk, read from the mmap'd chunk store only for these ids
+    (builds before the store fall back to the metadata's text_preview).
+    """
+    texts = _resident.get().texts
+    return [
+        (texts.get(vid) if texts is not None else None) or meta.get("text_preview", "")
+        for vid, _, meta in hits
+    ]
+
+def search(query: str, k: int = 5, hybrid: bool = False) -> List[Tuple[int, float, Dict]]:
+    if hybrid:
+        return search_hybrid(query, k=k)
+    snap = _resident.get()
+    qvec = _query_vector(query)
+    if qvec is None:
+        return _lexical_hits(snap, query, max(k, CANDIDATE_POOL))
+    _set_mode(MODE_VECTOR)
+    # L2 index by default
+    D, I = snap.index.search(qvec, max(k, CANDIDATE_POOL))
+    return _hits(D[0], I[0], snap.metadata)
+
+def _l2_to(snap: IndexSnapshot, qvec: np.ndarray, ids: List[int]) -> Dict[int, float]:
+    """Exact squared L2 from qvec to stored vectors, for hits that only the lexical side found."""
+    out: Dict[int, float] = {}
+    for vid in ids:
+        try:
+            v = snap.index.reconstruct(int(vid))
+        except Exception:
+            continue
+        out[vid] = float(np.sum((v - qvec.reshape(-1)) ** 2))
+    return out
+
+def search_hybrid(query: str, k: int = 5) -> List[Tuple[int, float, Dict]]:
+    """
+    BM25 + vector retrieval fused with reciprocal rank fusion. The query embedding
+    runs on the executor (see _query_vector) while the lexical lookup runs here, so
+    BM25 adds no wall-clock latency beyond its own few milliseconds. Hits keep their
+    true L2 distance for rerank.
+    Falls back to plain search() when the index has no BM25 postings.
+    """
+    snap = _resident.get()
+    if snap.lexical is None:
+        return search(query, k=k)
+    n = max(k, CANDIDATE_POOL)
+    wait_qvec = _submit_query_vector(query)
+    lexical_scores = snap.lexical.search(query, n)
+    qvec = wait_qvec()
+    if qvec is None:
+        _set_mode(MODE_LEXICAL_OFFLINE)
+        return [(vid, 1.0 / (1.0 + sc), snap.metadata.get(vid, {})) for vid, sc in lexical_scores]
+    _set_mode(MODE_HYBRID)
+    lexical = [vid for vid, _ in lexical_scores]
+    D, I = snap.index.search(qvec, n)
+
+    dists = {int(i): float(d) for d, i in zip(D[0], I[0]) if i != -1}
+    fused = [vid for vid, _ in reciprocal_rank_fusion([list(dists), lexical])][:n]
+    dists.update(_l2_to(snap, qvec, [vid for vid in fused if vid not in dists]))
+    return [(vid, dists[vid], snap.metadata.get(vid, {})) for vid in fused if vid in dists]
+
 def _parse_iso(s: Optional[str]) -> Optional[datetime]:
     if not s:
         return None
@@ -90,6 +480,46 @@ def _query_tags(query: str) -> List[str]:
     return [t for t in _TOKEN_RE.findall(query.lower()) if len(t) >= 3]
 
 def rerank(results: List[Tuple[int, float, Dict]], query: str, prefer_meetings: bool = False, prefer_recent: bool = False) -> List[Tuple[int,float,Dict]]:
+    """
+    Score = -L2 distance + 1000 per shared tag + meeting recency (prefer_recent)
+            + 1e9 for meetings (prefer_meetings) + ±reminder validity priority.
+    Computed as array ops over the snapshot's metadata columns; ordering is identical
+    to _rerank_rows, which is used when a result id isn't in the current index.
+    """
+    if not results:
+        return []
+    try:
+        cols = _columns(_resident.get())
+    except FileNotFoundError:
+        return _rerank_rows(results, query, prefer_meetings, prefer_recent)
+    rids = np.fromiter((int(r[0]) for r in results), dtype=np.int64, count=len(results))
+    pos, found = cols.positions(rids)
+    if not found.all():
+        return _rerank_rows(results, query, prefer_meetings, prefer_recent)
+
+    dist = np.fromiter((float(r[1]) for r in results), dtype=np.float64, count=len(results))
+    folder = cols.folder_code[pos]
+    mord = cols.meeting_ord[pos]
+
+    tag_bonus = _popcount(cols.tag_bits[pos] & cols.tag_mask(set(_query_tags(query)))) * 1000.0
+    meet_bonus = np.where(mord > 0, mord * 5.0, 0.0) if prefer_recent else np.zeros(len(results))
+    meeting_folder_priority = np.zeros(len(results))
+    if prefer_meetings:
+        meeting_folder_priority = np.where(np.isin(folder, cols.folder_codes(["meetings"])), 1_000_000_000.0, 0.0)
+    valid_now = _valid_at(cols.valid_from_ord[pos], cols.valid_to_ord[pos], datetime.now())
+    reminder_bonus = np.where(
+        np.isin(folder, cols.folder_codes(["reminders"])),
+        np.where(valid_now, 9_000_000.0, -1_000_000.0),
+        0.0,
+    )
+
+    # Same summation order as _rerank_rows so float ties break identically
+    score = -dist + tag_bonus + meet_bonus + meeting_folder_priority + reminder_bonus
+    order = np.argsort(-score, kind="stable")
+    return [results[i] for i in order]
+
+def _rerank_rows(results: List[Tuple[int, float, Dict]], query: str, prefer_meetings: bool = False, prefer_recent: bool = False) -> List[Tuple[int,float,Dict]]:
+    """Row-at-a-time scoring; reference for rerank() and fallback for results outside the index."""
     qtags = set(_query_tags(query))
     now = datetime.now()
 
@@ -136,7 +566,11 @@ def rerank(results: List[Tuple[int, float, Dict]], query: str, prefer_meetings:
     return [t for _, t in rescored]
 
 def search_meetings(query: str, k: int = 5, prefer_recent: bool = True) -> List[Tuple[int, float, Dict]]:
-    raw = search(query, k=max(k, 100))
+    # Meetings are pushed down into the search; other folders only top up a short list
+    raw = search_filtered(query, k=max(k, 100), folders=["meetings"])
+    if len(raw) < k:
+        seen = {rid for rid, _, _ in raw}
+        raw += [h for h in search(query, k=max(k, 100)) if h[0] not in seen]
     re_ranked = rerank(raw, query=query, prefer_meetings=True, prefer_recent=prefer_recent)
     return re_ranked[:k]
 
@@ -144,37 +578,190 @@ def filter_by_date_range(results: List[Tuple[int, float, Dict]], start: datetime
     """Keep results where:
        - meeting_date ∈ [start, end], OR
        - reminder validity window [valid_from, valid_to] overlaps [start, end]
+    Evaluated on the index's day-ordinal columns; no date strings are parsed.
     """
-    def _overlap(a_start: datetime, a_end: datetime, b_start: datetime, b_end: datetime) -> bool:
-        return a_start <= b_end and b_start <= a_end
-
-    kept: List[Tuple[int, float, Dict]] = []
-    for rid, dist, meta in results:
-        md = _parse_iso(meta.get("meeting_date"))
-        if md and (start <= md <= end):
-            kept.append((rid, dist, meta))
-            continue
-
-        vf = _parse_iso(meta.get("valid_from"))
-        vt = _parse_iso(meta.get("valid_to")) or datetime.max
-        if vf and _overlap(vf, vt, start, end):
-            kept.append((rid, dist, meta))
-
-    return kept
+    if not results:
+        return []
+    cols = _columns(_resident.get())
+    rids = np.fromiter((int(r[0]) for r in results), dtype=np.int64, count=len(results))
+    pos, found = cols.positions(rids)
+    keep = found & np.isin(rids, eligible_ids(cols, start=start, end=end))
+    return [r for r, ok in zip(results, keep) if ok]
 
 def rerank_for_recency(results: List[Tuple[int, float, Dict]], query: str, favor_recent: bool = True) -> List[Tuple[int, float, Dict]]:
     return rerank(results, query=query, prefer_meetings=False, prefer_recent=favor_recent)
 
 def search_in_date_window(query: str, start: datetime, end: datetime, k: int = 5) -> List[Tuple[int, float, Dict]]:
-    pool = search(query, k=max(k, 200))
-    windowed = filter_by_date_range(pool, start, end)
+    # Only in-window chunks are searched, so a narrow window can't be crowded out of the pool
+    windowed = search_filtered(query, k=max(k, CANDIDATE_POOL), start=start, end=end)
     if not windowed:
         return []
     return rerank_for_recency(windowed, query=query)[:k]
 
+def search_many(queries: List[str], k: int = 5, filters: Optional[Dict] = None) -> List[List[Tuple[int, float, Dict]]]:
+    """
+    Batch form of search for offline/evaluation workloads: one embeddings request,
+    one matrix index.search, then per-query filtering + rerank. Optional filters:
+      - start, end (datetime): only search inside the window (see eligible_ids)
+      - meetings_only (bool): only search the Meetings folder
+      - prefer_meetings, prefer_recent (bool): passed to rerank
+    Returns one top-k list per query, in input order. Query embeddings are bounded by
+    the client's own timeouts, not the interactive budget, and errors propagate.
+    """
+    if not queries:
+        return []
+    filters = filters or {}
+    snap = _resident.get()
+    qmat = embed_queries(list(queries))
+
+    start, end = filters.get("start"), filters.get("end")
+    ids = None
+    if (start and end) or filters.get("meetings_only"):
+        ids = eligible_ids(
+            _columns(snap),
+            folders=["meetings"] if filters.get("meetings_only") else None,
+            start=start if (start and end) else None,
+            end=end if (start and end) else None,
+        )
+    n = max(k, CANDIDATE_POOL)
+    _set_mode(MODE_VECTOR)
+    D, I = _search_selected(snap, qmat, n, ids)
+
+    out: List[List[Tuple[int, float, Dict]]] = []
+    for qi, query in enumerate(queries):
+        pool = _hits(D[qi], I[qi], snap.metadata)
+        ranked = rerank(
+            pool, query=query,
+            prefer_meetings=bool(filters.get("prefer_meetings", False)),
+            prefer_recent=bool(filters.get("prefer_recent", False)),
+        )
+        out.append(ranked[:k])
+    return out
+
+# ─────────────────────────────────────────────────────────────
+# Single-shot candidate pool for answer()'s retrieval planner
+# ─────────────────────────────────────────────────────────────
+PLAN_EXACT_LIMIT = 2048  # restrictions with at most this many chunks are scored exactly instead of searched
+
+class CandidatePool(NamedTuple):
+    general: List[Tuple[int, float, Dict]]   # nearest CANDIDATE_POOL chunks, nearest first
+    windowed: Optional[List[Tuple[int, float, Dict]]]  # in-window chunks, nearest first (None = no window)
+    mode: str                                # retrieval mode that produced the pool
+    meetings: Optional[List[Tuple[int, float, Dict]]] = None  # Meetings-folder chunks, nearest first (None = not asked)
+
+def _reconstruct(snap: IndexSnapshot, ids: np.ndarray) -> np.ndarray:
+    try:
+        return snap.index.reconstruct_batch(np.ascontiguousarray(ids, dtype=np.int64))
+    except Exception:
+        return np.vstack([snap.index.reconstruct(int(i)) for i in ids]) if len(ids) else np.zeros((0, EMBED_DIM), dtype=np.float32)
+
+def _exact_hits(snap: IndexSnapshot, qvec: np.ndarray, ids: np.ndarray, n: int) -> List[Tuple[int, float, Dict]]:
+    """The n of `ids` nearest to qvec, by exact L2 over their stored vectors."""
+    vecs = _reconstruct(snap, ids)
+    d = np.sum((vecs - qvec) ** 2, axis=1)
+    order = np.argsort(d, kind="stable")[:n]
+    return [(int(ids[i]), float(d[i]), snap.metadata.get(int(ids[i]), {})) for i in order]
+
+def _restricted_hits(snap: IndexSnapshot, qvec: np.ndarray, ids: np.ndarray, n: int) -> List[Tuple[int, float, Dict]]:
+    """Nearest n of `ids`: exact L2 when there are few, else an ANN search restricted to them."""
+    if len(ids) <= PLAN_EXACT_LIMIT:
+        return _exact_hits(snap, qvec, ids, n)
+    D, I = _search_selected(snap, qvec, n, ids)
+    return _hits(D[0], I[0], snap.metadata)
+
+def _pool_lexical(
+    snap: IndexSnapshot, query: str, window_ids: Optional[np.ndarray], meeting_ids: Optional[np.ndarray], n: int,
+) -> CandidatePool:
+    general = _lexical_hits(snap, query, n)
+    windowed = _lexical_hits(snap, query, n, allowed=window_ids) if window_ids is not None else None
+    meetings = _lexical_hits(snap, query, n, allowed=meeting_ids) if meeting_ids is not None else None
+    return CandidatePool(general, windowed, MODE_LEXICAL_OFFLINE, meetings)
+
+def _pool_vector(
+    snap: IndexSnapshot,
+    qvec: np.ndarray,
+    window_ids: Optional[np.ndarray],
+    meeting_ids: Optional[np.ndarray],
+    n: int,
+) -> CandidatePool:
+    D, I = snap.index.search(qvec, n)
+    general = _hits(D[0], I[0], snap.metadata)
+    windowed = _restricted_hits(snap, qvec, window_ids, n) if window_ids is not None else None
+    meetings = _restricted_hits(snap, qvec, meeting_ids, n) if meeting_ids is not None else None
+    return CandidatePool(general, windowed, MODE_VECTOR, meetings)
+
+def _pool_ids(snap: IndexSnapshot, start: Optional[datetime], end: Optional[datetime], meetings: bool):
+    cols = _columns(snap)
+    window_ids = eligible_ids(cols, start=start, end=end) if (start and end) else None
+    meeting_ids = eligible_ids(cols, folders=["meetings"]) if meetings else None
+    return window_ids, meeting_ids
+
+def candidate_pool(
+    query: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    n: int = CANDIDATE_POOL,
+    meetings: bool = False,
+) -> CandidatePool:
+    """
+    One query embedding, shared by every retrieval strategy.
+    pool.general is one ANN search. A date window fills pool.windowed from the in-window
+    chunks alone, and meetings=True fills pool.meetings from the Meetings folder alone:
+    scored exactly against the stored vectors when there are <= PLAN_EXACT_LIMIT of them,
+    otherwise with a second ANN search restricted to them (as in search_filtered). Asking
+    for both costs at most two restricted searches; plan_retrieval asks for one at most.
+    """
+    snap = _resident.get()
+    window_ids, meeting_ids = _pool_ids(snap, start, end, meetings)
+    qvec = _query_vector(query)
+    if qvec is None:
+        return _pool_lexical(snap, query, window_ids, meeting_ids, n)
+    _set_mode(MODE_VECTOR)
+    return _pool_vector(snap, qvec, window_ids, meeting_ids, n)
+
+async def _query_vector_async(query: str) -> Optional[np.ndarray]:
+    """Async _query_vector(): (1, EMBED_DIM) vector, or None when the embeddings API is unreachable."""
+    global _offline_until
+    if time.monotonic() < _offline_until:
+        cached = _query_cache.get(query)
+        return cached.reshape(1, -1) if cached is not None else None
+    try:
+        vec = await asyncio.wait_for(embed_query_async(query), EMBED_QUERY_TIMEOUT)
+    except Exception as e:
+        _embedding_failed(e)
+        return None
+    _offline_until = 0.0
+    return vec.reshape(1, -1)
+
+async def candidate_pool_async(
+    query: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    n: int = CANDIDATE_POOL,
+    meetings: bool = False,
+) -> CandidatePool:
+    """
+    candidate_pool() without holding a thread across the embeddings call. The BM25
+    lookup runs in a worker thread while the query is embedded, so falling back to
+    offline retrieval costs no extra latency; its result is dropped when the vector arrives.
+    """
+    snap = _resident.get()
+    window_ids, meeting_ids = _pool_ids(snap, start, end, meetings)
+    lexical = None
+    if snap.lexical is not None:
+        lexical = asyncio.ensure_future(asyncio.to_thread(_pool_lexical, snap, query, window_ids, meeting_ids, n))
+    try:
+        qvec = await _query_vector_async(query)
+        if qvec is None:
+            return await lexical if lexical is not None else _pool_lexical(snap, query, window_ids, meeting_ids, n)
+    finally:
+        if lexical is not None and not lexical.done():
+            lexical.cancel()
+    return await asyncio.to_thread(_pool_vector, snap, qvec, window_ids, meeting_ids, n)
+
 if __name__ == "__main__":
     hits = search_meetings("hr hiring policy last month", k=5)
-    for i, (vid, dist, meta) in enumerate(hits, 1):
+    for i, ((vid, dist, meta), text) in enumerate(zip(hits, chunk_texts(hits)), 1):
         print(f"{i}. dist={dist:.4f} file={meta.get('filename')} valid_from={meta.get('valid_from')} valid_to={meta.get('valid_to')}")
-        print((meta.get("text_preview", "") or "")[:160], "\n---")
+        print(text[:160], "\n---")
 
@@ -0,0 +1,159 @@
+import mmap
+import os
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+# Full chunk texts live outside the metadata, in two files (little-endian):
+#   chunks.bin: magic[8] | epoch: uint64 | utf-8 texts, append-only
+#   chunks.idx: magic[8] | epoch: uint64 | n: uint64 | ids: int64[n] (sorted) | offsets: int64[n] | lengths: int64[n]
+# A refresh appends new texts to chunks.bin and rewrites only the small table; bytes
+# already in the blob never change, so a reader holding an older table stays valid.
+# When more than half the blob is dead (dropped vectors) it is rewritten under a new
+# epoch, and a table/blob pair that does not agree on the epoch is rejected.
+_BLOB_MAGIC = b"BRTEXT01"
+_TABLE_MAGIC = b"BRTIDX01"
+_HEADER = 16
+
+class TextTable(NamedTuple):
+    epoch: int
+    ids: np.ndarray       # int64, sorted
+    offsets: np.ndarray   # int64 byte offsets into chunks.bin
+    lengths: np.ndarray   # int64 byte lengths
+
+def write_table(path: Path, table: TextTable) -> None:
+    with open(path, "wb") as f:
+        f.write(_TABLE_MAGIC)
+        f.write(np.array([table.epoch, len(table.ids)], dtype="<u8").tobytes())
+        f.write(np.asarray(table.ids, dtype="<i8").tobytes())
+        f.write(np.asarray(table.offsets, dtype="<i8").tobytes())
+        f.write(np.asarray(table.lengths, dtype="<i8").tobytes())
+
+def read_table(path: Path) -> Optional[TextTable]:
+    try:
+        raw = Path(path).read_bytes()
+    except OSError:
+        return None
+    if raw[:8] != _TABLE_MAGIC:
+        return None
+    epoch, n = (int(v) for v in np.frombuffer(raw, dtype="<u8", count=2, offset=8))
+    cols = np.frombuffer(raw, dtype="<i8", count=3 * n, offset=_HEADER + 8).reshape(3, n)
+    return TextTable(epoch, cols[0], cols[1], cols[2])
+
+def _blob_epoch(path: Path) -> Optional[int]:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_HEADER)
+    except OSError:
+        return None
+    if len(head) < _HEADER or head[:8] != _BLOB_MAGIC:
+        return None
+    return int.from_bytes(head[8:], "little")
+
+class TextWriter:
+    """
+    Writes a new table's worth of texts: the ids in `keep` (already in the store) plus
+    each text passed to add(), which goes straight to the blob so a refresh never holds
+    the texts in memory. Compacts the blob into a fresh epoch when it is missing, does
+    not match the table, or holds more dead bytes than live ones. close() returns the
+    table (write it with write_table).
+    """
+    def __init__(self, blob_path: Path, table_path: Path, keep: Iterable[int]):
+        self._blob_path = Path(blob_path)
+        old = read_table(table_path)
+        if old is None or _blob_epoch(self._blob_path) != old.epoch:
+            old = TextTable(0, np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64))
+        keep_ids = np.unique(np.fromiter((int(i) for i in keep), dtype=np.int64))
+        pos = np.minimum(np.searchsorted(old.ids, keep_ids), max(len(old.ids) - 1, 0))
+        found = old.ids[pos] == keep_ids if len(old.ids) else np.zeros(len(keep_ids), dtype=bool)
+        if not found.all():
+            raise KeyError(f"{int((~found).sum())} kept id(s) have no stored text")
+        kept_off, kept_len = old.offsets[pos], old.lengths[pos]
+        size = self._blob_path.stat().st_size if old.epoch else 0
+
+        if old.epoch and size - _HEADER <= 2 * int(kept_len.sum()):
+            self.epoch, self._tmp = old.epoch, None
+            self._f = open(self._blob_path, "ab")
+            self._at = self._f.tell() - _HEADER
+        else:
+            self.epoch = int.from_bytes(os.urandom(8), "little") | 1
+            self._tmp = self._blob_path.with_name(self._blob_path.name + ".tmp")
+            self._f = open(self._tmp, "wb")
+            self._f.write(_BLOB_MAGIC)
+            self._f.write(np.uint64(self.epoch).astype("<u8").tobytes())
+            moved = np.zeros(len(keep_ids), dtype=np.int64)
+            if len(keep_ids):
+                with open(self._blob_path, "rb") as src:
+                    mm = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        at = 0
+                        for i, (o, n) in enumerate(zip(kept_off, kept_len)):
+                            self._f.write(mm[_HEADER + int(o):_HEADER + int(o) + int(n)])
+                            moved[i] = at
+                            at += int(n)
+                    finally:
+                        mm.close()
+            kept_off = moved
+            self._at = int(kept_len.sum())
+        self._kept = (keep_ids, kept_off, kept_len)
+        self._new_ids: List[int] = []
+        self._new_off: List[int] = []
+        self._new_len: List[int] = []
+
+    def add(self, vid: int, text: str) -> None:
+        data = text.encode("utf-8")
+        self._f.write(data)
+        self._new_ids.append(int(vid))
+        self._new_off.append(self._at)
+        self._new_len.append(len(data))
+        self._at += len(data)
+
+    def close(self) -> TextTable:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        if self._tmp is not None:
+            os.replace(self._tmp, self._blob_path)
+        keep_ids, kept_off, kept_len = self._kept
+        new_ids = np.asarray(self._new_ids, dtype=np.int64)
+        old = ~np.isin(keep_ids, new_ids)  # a re-added id takes its new text
+        ids = np.concatenate((keep_ids[old], new_ids))
+        order = np.argsort(ids, kind="stable")
+        offsets = np.concatenate((kept_off[old], np.asarray(self._new_off, dtype=np.int64)))
+        lengths = np.concatenate((kept_len[old], np.asarray(self._new_len, dtype=np.int64)))
+        return TextTable(self.epoch, ids[order], offsets[order].astype(np.int64), lengths[order].astype(np.int64))
+
+class ChunkTexts:
+    """
+    Read-only view of the chunk text store: the table is loaded (3 int64s per vector)
+    and the blob is mmap'd, so a text is decoded only when asked for.
+    """
+    def __init__(self, blob_path: Path, table_path: Path):
+        table = read_table(table_path)
+        if table is None:
+            raise ValueError(f"{table_path} is not a chunk text table")
+        with open(blob_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != _BLOB_MAGIC or int.from_bytes(self._mm[8:_HEADER], "little") != table.epoch:
+            self._mm.close()
+            raise ValueError(f"{blob_path} does not match {table_path}")
+        self._table = table
+
+    def get(self, vid: int, default: Optional[str] = None) -> Optional[str]:
+        ids = self._table.ids
+        i = int(np.searchsorted(ids, vid))
+        if i >= len(ids) or int(ids[i]) != vid:
+            return default
+        start = _HEADER + int(self._table.offsets[i])
+        return str(self._mm[start:start + int(self._table.lengths[i])], "utf-8")
+
+    def __contains__(self, vid) -> bool:
+        i = int(np.searchsorted(self._table.ids, vid))
+        return i < len(self._table.ids) and int(self._table.ids[i]) == vid
+
+    def __len__(self) -> int:
+        return len(self._table.ids)
+
+    def close(self) -> None:
+        self._mm.close()
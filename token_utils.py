@@ -0,0 +1,36 @@
+from functools import lru_cache
+from typing import Optional
+
+# tiktoken is optional: without it we fall back to a conservative chars/token estimate
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None
+
+DEFAULT_MODEL = "text-embedding-3-small"
+_FALLBACK_CHARS_PER_TOKEN = 3  # numeric tables tokenize densely; err on the high side
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def has_tokenizer(model: str = DEFAULT_MODEL) -> bool:
+    """True when counts are exact (tiktoken + encoding available), False when estimated."""
+    return _encoding(model) is not None
+
+def count_tokens(text: Optional[str], model: str = DEFAULT_MODEL) -> int:
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return -(-len(text) // _FALLBACK_CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))